@@ -1,8 +1,11 @@
 #!/bin/bash
 
 if [ "$APP_MODE" == "worker" ]; then
-  # Start the Celery worker
-  $PYTHON_BIN -m celery -A osp.app.tasks:celery worker -Q $REAXPRO_WORKER_NAME -n $REAXPRO_WORKER_NAME --concurrency $REAXPRO_WORKER_CONCURRENCY
+  # Start the Celery worker, the head worker embeds the beat sweeping the cache
+  if [ "$REAXPRO_WORKER_BEAT" == "true" ]; then
+    BEAT_OPTION="-B"
+  fi
+  $PYTHON_BIN -m celery -A osp.app.tasks:celery worker -Q $REAXPRO_WORKER_NAME -n $REAXPRO_WORKER_NAME --concurrency $REAXPRO_WORKER_CONCURRENCY $BEAT_OPTION
 elif [ "$APP_MODE" == "server" ]; then
   # Start the uvicorn server
   $PYTHON_BIN -m osp.app.main
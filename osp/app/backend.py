@@ -0,0 +1,31 @@
+"""Reads of the metadata of celery-tasks from the result backend"""
+from typing import TYPE_CHECKING
+
+from celery import states
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, Dict, List
+
+    from celery import Celery
+    from redis.asyncio import Redis
+
+
+async def fetch_task_meta(
+    task_ids: "List[str]", celery_app: "Celery", redis: "Redis"
+) -> "List[Dict[str, Any]]":
+    """Read the metadata of tasks from the result backend with a single MGET.
+
+    Tasks which are not (yet) known to the backend are reported as pending,
+    as celery does for `AsyncResult`."""
+    backend = celery_app.backend
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    payloads = await redis.mget(keys) if keys else []
+    metas = []
+    for task_id, payload in zip(task_ids, payloads):
+        if payload:
+            meta = backend.decode_result(payload)
+        else:
+            meta = {"status": states.PENDING, "result": None, "traceback": None}
+        meta["task_id"] = task_id
+        metas.append(meta)
+    return metas
@@ -140,11 +140,11 @@ def start_platform(config):
             reaxpro_processes[worker_model.name] = _run_worker(worker_model)
 
     if model.reaxpro.fastapi:
-        from .main import app  # pylint: disable=import-outside-toplevel
-
-        # fastapi variables
+        # fastapi variables, needed before the app builds its model registry
         os.environ["REAXPRO_SCHEMAS"] = model.reaxpro.fastapi.schemas
 
+        from .main import app  # pylint: disable=import-outside-toplevel
+
         # start fastapi
         click.echo(f"{green}INFO{reset}:\tStarting FastAPI...")
         uvicorn.run(
@@ -182,6 +182,8 @@ def _run_head(model: HeadModel) -> subprocess.Popen:
         model.name,
         "-n",
         model.name,
+        # embedded beat scheduling the sweeper of the cache
+        "-B",
     ]
     env = os.environ.copy()
     env["REAXPRO_WORKER_NAME"] = model.name
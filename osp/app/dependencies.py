@@ -2,24 +2,44 @@
 
 import logging
 import os
-import tempfile
+from functools import lru_cache
 from importlib import import_module
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 from uuid import UUID
 
 from celery import Celery
 from celery.app.control import Inspect
-from fastapi import Depends, Query, UploadFile
+from fastapi import Depends, Header, HTTPException, Query, UploadFile
+from fastapi_plugins import depends_redis
 from minio import Minio
+from minio.datatypes import Object
+from pydantic.schema import schema
 from shieldapi.frameworks.fastapi import AuthTokenBearer
 from urllib3.response import HTTPResponse
 
-from osp.settings import AppConfig
-from osp.utilities.helper import _get_download, _get_upload
+from osp.app.s3 import read_logs
+from osp.settings import AppConfig, get_settings
+from osp.utilities import get_minio
+from osp.utilities.compression import accepted_codec
+from osp.utilities.exceptions import MinioDownloadError
+from osp.utilities.helper import (
+    _get_base,
+    _get_codec,
+    _get_download,
+    _get_stat,
+    _put_stream,
+)
+
+from .backend import fetch_task_meta
+from .models import InfoType, LogsPage, LogsQuery, UploadNotEnabledError
+from .registry import WorkerRegistry
+from .scheduling import ANONYMOUS, Scheduler, get_owner
 
 if TYPE_CHECKING:  # pragma: no cover
     from typing import Collection
 
+    from redis.asyncio import Redis
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -41,7 +61,7 @@ def get_method() -> Callable:
 
 def get_appconfig() -> AppConfig:
     """Returns app-config."""
-    return AppConfig()
+    return get_settings()
 
 
 def get_dependencies() -> "List[Depends]":
@@ -56,9 +76,34 @@ def get_dependencies() -> "List[Depends]":
     return dependencies
 
 
+def depends_owner(
+    authorization: Optional[str] = Header(None, alias="Authorization"),
+    config: AppConfig = Depends(get_appconfig),
+) -> str:
+    """Return the identity submitting a request due to its token via `Depends`.
+
+    Tokens without subject are rejected if the owners are told apart by the
+    fair share or the quota, which they would otherwise share as `anonymous`."""
+    if not config.authentication_dependencies:
+        return ANONYMOUS
+    strict = config.fair_share or bool(config.owner_max_inflight)
+    return get_owner(authorization, strict=strict)
+
+
+def depends_scheduler(
+    owner: str = Depends(depends_owner),
+    celery_app: "Celery" = Depends(get_app),
+    redis=Depends(depends_redis),
+    config: AppConfig = Depends(get_appconfig),
+) -> Scheduler:
+    """Return the scheduler of the submissions of the owner via `Depends`."""
+    return Scheduler(owner, celery_app, redis, config)
+
+
+@lru_cache(maxsize=None)
 def get_models() -> "Dict[str, Callable]":
     """Get registry of pydantic models."""
-    app_config = AppConfig()
+    app_config = get_settings()
     modules = [module.strip().split(":") for module in app_config.schemas.split("|")]
     return {
         classname: getattr(import_module(module), classname)
@@ -66,25 +111,55 @@ def get_models() -> "Dict[str, Callable]":
     }
 
 
+@lru_cache(maxsize=None)
+def get_model_info() -> "Dict[str, Dict[InfoType, Any]]":
+    """Get pre-rendered schema and example of the registered pydantic models."""
+    return {
+        name: {
+            InfoType.SCHEMA: schema([model]),
+            InfoType.EXAMPLE: (model.Config.schema_extra or {}).get("example"),
+        }
+        for name, model in get_models().items()
+    }
+
+
 def depends_modellist() -> "List[str]":
     """Get list of model names."""
     registry = get_models()
     return list(registry.keys())
 
 
+async def depends_task_meta(
+    transformation_id: str,
+    celery_app: "Celery" = Depends(get_app),
+    redis=Depends(depends_redis),
+) -> "Dict[str, Any]":
+    """Return the metadata of a task from the result backend via `Depends`."""
+    metas = await fetch_task_meta([transformation_id], celery_app, redis)
+    return metas.pop()
+
+
 def depends_inspect(celery_app: "Celery" = Depends(get_app)) -> Inspect:
     """Return the object from the celery app for the backend inspection."""
     return celery_app.control.inspect()
 
 
+@lru_cache(maxsize=None)
+def get_worker_registry() -> WorkerRegistry:
+    """Return the registry of remote workers shared within the process."""
+    return WorkerRegistry(get_app(), ttl=get_settings().worker_registry_ttl)
+
+
+def depends_worker_registry() -> "Dict[str, Any]":
+    """Return the cached registry of the remote workers and its staleness."""
+    return get_worker_registry().snapshot()
+
+
 def depends_registry(
-    inspect: Inspect = Depends(depends_inspect),
+    snapshot: "Dict[str, Any]" = Depends(depends_worker_registry),
 ) -> "Dict[Any, Collection[str]]":
     """Return a mapping between the workers id and registered tasks"""
-    registry = inspect.registered_tasks()
-    if not registry:
-        registry = {}
-    return registry
+    return snapshot["registered_tasks"]
 
 
 def depends_tasks(registry: dict = Depends(depends_registry)) -> "List[str]":
@@ -97,44 +172,157 @@ def depends_tasks(registry: dict = Depends(depends_registry)) -> "List[str]":
     return task_list
 
 
-def depends_minio(settings: AppConfig = Depends(get_appconfig)) -> Minio:
-    """Instantiate MinIO-client via `Depends`."""
-    return Minio(
-        settings.minio_endpoint,
-        access_key=settings.minio_user.get_secret_value(),
-        secret_key=settings.minio_password.get_secret_value(),
-        secure=False,
-    )
+def depends_minio() -> Minio:
+    """Return the MinIO-client shared within the process via `Depends`."""
+    return get_minio()
+
+
+def depends_upload_enabled(config: AppConfig = Depends(get_appconfig)) -> bool:
+    """Check whether direct upoad to data cache is enabled or not"""
+    return config.enable_upload
 
 
 def depends_upload(
     file: UploadFile,
     uuid: Optional[UUID] = None,
+    upload_enabled: bool = Depends(depends_upload_enabled),
     minio_client: Minio = Depends(depends_minio),
-) -> UUID:
-    """Upload file with minio client and return upload-id via `Depends`."""
+) -> "Tuple[str, Optional[str]]":
+    """Stream file with minio client and return upload-id and hash via `Depends`."""
+    if not upload_enabled:
+        raise UploadNotEnabledError("Direct upload to cache is not enabled")
     suffix = os.path.splitext(file.filename)[-1]
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp:
-        temp.write(file.file.read())
-    return _get_upload(temp.name, uuid, minio_client)
+    return _put_stream(file.file, suffix, str(uuid) if uuid else None, minio_client)
 
 
-def depends_upload_enabled(config: AppConfig = Depends(get_appconfig)) -> bool:
-    """Check whether direct upoad to data cache is enabled or not"""
-    return config.enable_upload
+def depends_stat(
+    dataset_name: str = Query(..., title="Cache ID received after the upload."),
+    minio_client: Minio = Depends(depends_minio),
+) -> Object:
+    """Return the metadata of an object through minio client via `Depends`."""
+    return _get_stat(dataset_name, minio_client)
+
+
+def depends_encoding(
+    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding"),
+    stat: Object = Depends(depends_stat),
+) -> Optional[str]:
+    """Return the codec of a compressed object if the client accepts it as
+    content-coding, such that the object is sent as stored, via `Depends`."""
+    codec = _get_codec(stat.metadata)
+    # deltas are reconstructed before they are sent
+    if _get_base(stat.metadata):
+        return None
+    if codec and accepted_codec(accept_encoding, codec):
+        return codec
+    return None
+
+
+def depends_range(
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None, alias="If-Range"),
+    stat: Object = Depends(depends_stat),
+    encoding: Optional[str] = Depends(depends_encoding),
+) -> "Optional[Tuple[int, int]]":
+    """Return first and last byte of the requested range via `Depends`.
+
+    Only single byte-ranges are supported. Any other or malformed range
+    as well as an outdated `If-Range` will return the complete object.
+    Compressed objects only support ranges if sent as stored, deltas never."""
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    if not _ranges_applicable(stat, encoding, if_range):
+        return None
+    spec = range_header[len("bytes=") :].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    first, last = (value.strip() for value in spec.split("-", 1))
+    try:
+        if not first:
+            # suffix-range, e.g. the last 500 bytes: `bytes=-500`
+            start, end = max(stat.size - int(last), 0), stat.size - 1
+        else:
+            start = int(first)
+            end = min(int(last), stat.size - 1) if last else stat.size - 1
+    except ValueError:
+        return None
+    if start > end or start >= stat.size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable.",
+            headers={"Content-Range": f"bytes */{stat.size}"},
+        )
+    return start, end
+
+
+def _ranges_applicable(
+    stat: Object, encoding: Optional[str], if_range: Optional[str]
+) -> bool:
+    """Whether byte-ranges of the object as sent refer to the object as stored,
+    which is not the case for deltas, decompressed objects and outdated ones."""
+    if _get_base(stat.metadata):
+        return False
+    if _get_codec(stat.metadata) and not encoding:
+        return False
+    return not if_range or if_range.strip('"') == stat.etag
 
 
 def depends_download(
     dataset_name: str = Query(..., title="Cache ID received after the upload."),
+    byte_range: "Optional[Tuple[int, int]]" = Depends(depends_range),
+    stat: Object = Depends(depends_stat),
     minio_client: Minio = Depends(depends_minio),
-) -> HTTPResponse:
-    """Return `HTTPResponse` from uuid through minio client via `Depends`."""
+) -> "Optional[HTTPResponse]":
+    """Return `HTTPResponse` from uuid through minio client via `Depends`.
+
+    Deltas are not streamed as stored, hence `None` is returned for them."""
+    if _get_base(stat.metadata):
+        return None
+    if byte_range:
+        start, end = byte_range
+        return _get_download(
+            dataset_name, minio_client, offset=start, length=end - start + 1
+        )
     return _get_download(dataset_name, minio_client)
 
 
+def depends_logs_query(
+    cursor: Optional[str] = Query(
+        None,
+        description="""Position after the logging messages of a previous read,
+        as returned in its `X-Next-Cursor`-header. From the start if not set.""",
+    ),
+    limit: int = Query(
+        0, ge=0, description="Maximum number of bytes returned. All if set to 0."
+    ),
+    follow: bool = Query(
+        False,
+        description="Keep streaming new logging messages until the task is finished.",
+    ),
+) -> LogsQuery:
+    """Return the query of the logging messages via `Depends`."""
+    return LogsQuery(cursor=cursor, limit=limit, follow=follow)
+
+
 def depends_logs(
     transformation_id: str = Query(..., title="task id of the submitted job"),
+    query: LogsQuery = Depends(depends_logs_query),
     minio_client: Minio = Depends(depends_minio),
-) -> HTTPResponse:
-    """Return `HTTPResponse` from uuid through minio client via `Depends`."""
-    return _get_download(transformation_id, minio_client)
+) -> LogsPage:
+    """Return the logging messages of a task after the cursor of the query
+    and the cursor of the next read through minio client via `Depends`.
+
+    Missing logs are empty when followed, since they may not be written yet."""
+    try:
+        content, cursor = read_logs(
+            transformation_id, minio_client, query.cursor, query.limit
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error)) from error
+    except MinioDownloadError:
+        if not query.follow:
+            raise
+        content, cursor = b"", query.cursor
+    return LogsPage(
+        task_id=transformation_id, content=content, cursor=cursor, query=query
+    )
@@ -0,0 +1,103 @@
+"""Streams about the state and the logs of celery-tasks"""
+import asyncio
+import json
+from typing import TYPE_CHECKING
+
+from celery import states
+from starlette.concurrency import run_in_threadpool
+
+from osp.utilities.exceptions import MinioDownloadError
+from osp.utilities.helper import progress_channel
+
+from .backend import fetch_task_meta
+from .models import LogsPage, TaskStateModel
+from .s3 import read_logs
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import AsyncIterator, Optional, Union
+
+    from celery import Celery
+    from minio import Minio
+    from redis.asyncio import Redis
+
+
+def format_event(event: str, data: str) -> str:
+    """Format a message according to the protocol of server-sent events."""
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def _decode(value: "Union[str, bytes]") -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def iter_events(
+    task_id: str, celery_app: "Celery", redis: "Redis", keepalive: float
+) -> "AsyncIterator[str]":
+    """Yield the state changes of a task and the progress of its workflow steps.
+
+    The result backend publishes the metadata of a task on the channel of
+    its key whenever the state is stored, while the workflow engine
+    publishes the progress of the steps on a separate channel. The stream
+    starts with the current state and ends once the task is ready."""
+    state_channel = _decode(celery_app.backend.get_key_for_task(task_id))
+    pubsub = redis.pubsub()
+    # subscribe before fetching the current state in order not to miss changes
+    await pubsub.subscribe(state_channel, progress_channel(task_id))
+    try:
+        [meta] = await fetch_task_meta([task_id], celery_app, redis)
+        yield format_event("state", TaskStateModel.from_meta(meta).json())
+        while meta["status"] not in states.READY_STATES:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=keepalive
+            )
+            if not message:
+                yield ": keepalive\n\n"
+            elif _decode(message["channel"]) == state_channel:
+                meta = celery_app.backend.decode_result(message["data"])
+                meta["task_id"] = task_id
+                yield format_event("state", TaskStateModel.from_meta(meta).json())
+            else:
+                progress = json.loads(message["data"])
+                yield format_event("progress", json.dumps(progress))
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
+
+
+async def follow_logs(
+    logs: LogsPage,
+    celery_app: "Celery",
+    redis: "Redis",
+    minio_client: "Minio",
+    interval: float,
+) -> "AsyncIterator[bytes]":
+    """Yield the logging messages of a task and poll for new ones until it is ready
+    or, if given, the `limit` of the query was sent including the first read.
+
+    Only the chunks after the cursor of the previous read are fetched."""
+    limit = logs.query.limit
+    remaining = limit - len(logs.content) if limit else None
+    cursor = logs.cursor
+    if logs.content:
+        yield logs.content
+    while remaining is None or remaining > 0:
+        [meta] = await fetch_task_meta([logs.task_id], celery_app, redis)
+        ready = meta["status"] in states.READY_STATES
+        try:
+            content, cursor = await run_in_threadpool(
+                read_logs,
+                logs.task_id,
+                minio_client,
+                cursor,
+                remaining or 0,
+                final=ready,
+            )
+        except MinioDownloadError:
+            content = b""
+        if content:
+            yield content
+            if remaining is not None:
+                remaining -= len(content)
+        if ready:
+            break
+        await asyncio.sleep(interval)
@@ -2,57 +2,82 @@
 import logging
 import os
 from datetime import datetime
-from typing import Annotated, Any, Dict, List, Optional, Union
-from uuid import UUID
+from email.utils import format_datetime
+from typing import Annotated, Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import pkg_resources
 import uvicorn
-from celery import Celery
+from celery import Celery, states
 from fastapi import Body, Depends, FastAPI, HTTPException, Query, Response
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import JSONResponse, RedirectResponse
-
-# from fastapi.responses import StreamingResponse
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from fastapi_plugins import (
     config_plugin,
+    depends_redis,
     get_config,
     redis_plugin,
     register_config,
     register_middleware,
 )
-from minio import ServerError
+from minio import Minio, ServerError
+from minio.datatypes import Object
 from pydantic.error_wrappers import ValidationError
-from pydantic.schema import schema
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from urllib3.response import HTTPResponse
 
-from osp.settings import AppConfig
+from osp.settings import AppConfig, get_settings
+from osp.utilities import clients, get_download, get_minio
+from osp.utilities.compression import decompress
+from osp.utilities.exceptions import MinioDownloadError
+from osp.utilities.helper import _get_base, _get_codec, _iter_download
 
+from .backend import fetch_task_meta
 from .dependencies import (
     depends_download,
+    depends_encoding,
     depends_logs,
+    depends_minio,
     depends_modellist,
-    depends_registry,
+    depends_owner,
+    depends_range,
+    depends_scheduler,
+    depends_stat,
+    depends_task_meta,
     depends_upload,
-    depends_upload_enabled,
+    depends_worker_registry,
     get_app,
     get_appconfig,
     get_dependencies,
+    get_model_info,
     get_models,
+    get_worker_registry,
 )
+from .events import follow_logs, iter_events
 from .models import (
     InfoType,
+    LogsPage,
+    QueueDepthModel,
     RegisteredModels,
     RegisteredTaskModel,
     SubmissionBody,
     TaskCreateModel,
     TaskKillModel,
     TaskResultModel,
+    TaskStateModel,
+    TaskStatesBody,
+    TaskStatesModel,
     TaskStatusModel,
     TransformationStatus,
     UploadDataResponse,
     UploadNotEnabledError,
-    task_to_transformation_map,
 )
+from .scheduling import Scheduler, count_inflight, get_queues, queue_depths
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -103,43 +128,93 @@ async def root():
 
 @app.put("/data/cache", operation_id="createDataset")
 async def upload_data(
-    object_key: UUID = Depends(depends_upload),
-    upload_enabled: bool = Depends(depends_upload_enabled),
+    upload: Tuple[str, Optional[str]] = Depends(depends_upload),
 ) -> UploadDataResponse:
     """Upload data from internal cache"""
-    if not upload_enabled:
-        raise UploadNotEnabledError("Direct upload to cache is not enabled")
-    return UploadDataResponse(id=object_key, last_modified=str(datetime.now()))
+    object_key, checksum = upload
+    return UploadDataResponse(
+        id=object_key, last_modified=str(datetime.now()), checksum=checksum
+    )
 
 
 @app.get("/data/cache/{dataset_name}", operation_id="getDataset")
 async def download_data(
     dataset_name: str,
-    response=Depends(depends_download),
-) -> Response:
-    """Download file via StreamingResponse"""
-    filename = str(dataset_name) + response.headers.get("x-amz-meta-suffix")
-    # return StreamingResponse(
-    #     iter(response.readlines()),
-    #     media_type="multipart/form-data",
-    #     headers={"Content-Disposition": f"attachment; filename={filename}"},
-    # )
-    response = Response(response.data)
+    stat: Object = Depends(depends_stat),
+    byte_range: Optional[Tuple[int, int]] = Depends(depends_range),
+    encoding: Optional[str] = Depends(depends_encoding),
+    response: Optional[HTTPResponse] = Depends(depends_download),
+) -> StreamingResponse:
+    """Download file via StreamingResponse
+
+    Compressed objects are sent as stored if the client accepts their codec
+    through `Accept-Encoding`, otherwise they are decompressed on the fly.
+    Graphs stored as deltas are reconstructed from their bases first."""
+    filename = str(dataset_name) + stat.metadata.get("x-amz-meta-suffix", "")
     # Set the appropriate headers
-    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
-    response.headers["Content-Type"] = "application/octet-stream"
-    return response
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{stat.etag}"',
+        "Last-Modified": format_datetime(stat.last_modified, usegmt=True),
+    }
+    if _get_base(stat.metadata):
+        headers["Accept-Ranges"] = "none"
+        headers["ETag"] = f'W/"{stat.etag}"'
+        path = await run_in_threadpool(get_download, dataset_name, True)
+        return FileResponse(
+            path,
+            media_type="application/octet-stream",
+            headers=headers,
+            background=BackgroundTask(os.remove, path),
+        )
+    codec = _get_codec(stat.metadata)
+    if codec:
+        headers["Vary"] = "Accept-Encoding"
+    if codec and not encoding:
+        # the size of the decompressed content is unknown in advance
+        headers["Accept-Ranges"] = "none"
+        headers["ETag"] = f'W/"{stat.etag}"'
+        return StreamingResponse(
+            _iter_object(response, codec),
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.size}"
+        headers["Content-Length"] = str(end - start + 1)
+    else:
+        status_code = 200
+        headers["Content-Length"] = str(stat.size)
+    return StreamingResponse(
+        _iter_object(response),
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
+
+
+def _iter_object(
+    response: HTTPResponse, codec: Optional[str] = None
+) -> Iterator[bytes]:
+    """Stream the content of an object, decompressing it with the codec if given."""
+    chunks = _iter_download(response, get_settings().download_chunk_size)
+    return decompress(chunks, codec) if codec else chunks
 
 
 @app.get("/workers/registered")
 async def get_workers_available(
-    registry: Union[dict, None] = Depends(depends_registry)
+    snapshot: "Dict[str, Any]" = Depends(depends_worker_registry),
 ) -> RegisteredTaskModel:
     """Return the list of runable and registered tasks"""
     return RegisteredTaskModel(
         **{
             "message": "Fetched registry of executable tasks on remote workers.",
-            "registered_tasks": registry,
+            **snapshot,
         }
     )
 
@@ -169,16 +244,19 @@ async def get_info(
     ),
 ) -> Union[Dict[Any, Any], Any]:
     """Get specific app info"""
+    info = get_model_info().get(model_name)
+    if not info:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {model_name}")
     if info_type == InfoType.SCHEMA:
         # Retreive schema of a model registered in the app
-        models = get_models()
-        model = models.get(model_name)
-        response = schema([model])
+        response = info[InfoType.SCHEMA]
     elif info_type == InfoType.EXAMPLE:
         # Retrieve an example for a model registered in the app
-        models = get_models()
-        model = models.get(model_name)
-        response = JSONResponse(model.Config.schema_extra["example"])
+        if info[InfoType.EXAMPLE] is None:
+            raise HTTPException(
+                status_code=404, detail=f"No example for model: {model_name}"
+            )
+        response = JSONResponse(info[InfoType.EXAMPLE])
     return response
 
 
@@ -208,97 +286,152 @@ async def update_task(
         SubmissionBody,
         Body(),
     ],
+    scheduler: Scheduler = Depends(depends_scheduler),
     celery_app: "Celery" = Depends(get_app),
-    settings: AppConfig = Depends(get_appconfig),
+    redis=Depends(depends_redis),
 ) -> TaskStatusModel:
-    """Get status of the transformation."""
+    """Get status of the transformation.
+
+    Transformations are queued by their priority, which is lowered by the
+    rank of the owner among the owners with transformations in flight if
+    fair share is enabled. Submissions are rejected with status 429 while a queue is
+    saturated or the owner exhausted its quota."""
     state = body.state
     if state == TransformationStatus.RUNNING:
-        # Send a task to a remote celery worker
-        task = celery_app.send_task(
-            settings.worker_name,
-            kwargs={"cache_key": transformation_id, "store_tarball": False},
-            queue=settings.worker_name,
+        task_id = await scheduler.submit(
+            {
+                "cache_key": transformation_id,
+                "store_tarball": False,
+                "use_cache": body.use_cache,
+                "resume": body.resume,
+                "graph_format": body.format.value,
+            },
+            priority=body.priority,
         )
-        response = TaskStatusModel(
-            status=task.status,
-            state=task_to_transformation_map[task.state],
-            result=task.result,
-            traceback=task.traceback,
-            id=task.id,
-            args=task.args,
-            kwargs=task.kwargs,
-            date_done=task.date_done,
+        response = TaskStatusModel.from_meta(
+            {"status": states.PENDING, "task_id": task_id}
         )
     elif state == TransformationStatus.STOPPED:
         # Kill a submitted task with certain id
-        task = celery_app.AsyncResult(transformation_id)
-        if not task.date_done:
-            task.revoke(terminate=True)
+        [meta] = await fetch_task_meta([transformation_id], celery_app, redis)
+        if not meta.get("date_done"):
+            await run_in_threadpool(
+                celery_app.control.revoke, transformation_id, terminate=True
+            )
             message = "Killing scheduled."
         else:
             message = "Task already terminated."
-        response = TaskKillModel(
-            message=message,
-            status=task.status,
-            state=task_to_transformation_map[task.state],
-            result=task.result,
-            traceback=task.traceback,
-            id=task.id,
-            args=task.args,
-            kwargs=task.kwargs,
-            date_done=task.date_done,
-        )
+        response = TaskKillModel.from_meta(meta, message=message)
     else:
         raise HTTPException(status_code=400, detail=f"Unknown task status: {state}")
     return response
 
 
+@app.get("/queues", operation_id="getQueues")
+async def get_queues_depth(
+    owner: str = Depends(depends_owner),
+    celery_app: "Celery" = Depends(get_app),
+    settings: AppConfig = Depends(get_appconfig),
+    redis=Depends(depends_redis),
+) -> QueueDepthModel:
+    """Return the depths of the queues and the transformations of the owner"""
+    depths = await queue_depths(
+        get_queues(settings.worker_name, settings.worker_mapping), redis
+    )
+    inflight = await count_inflight(owner, celery_app, redis, settings.inflight_ttl)
+    return QueueDepthModel(
+        queues=depths,
+        max_depth=settings.queue_max_depth,
+        saturated=bool(settings.queue_max_depth)
+        and any(depth >= settings.queue_max_depth for depth in depths.values()),
+        inflight=inflight,
+        max_inflight=settings.owner_max_inflight,
+    )
+
+
 @app.get("/logs", operation_id="getLogs")
-def get_logs(
-    transformation_id: str = Query(  # pylint: disable=unused-argument
-        ..., title="task id of the submitted job"
-    ),
-    response: HTTPResponse = Depends(depends_logs),
+async def get_logs(
+    logs: LogsPage = Depends(depends_logs),
+    celery_app: "Celery" = Depends(get_app),
+    redis=Depends(depends_redis),
+    minio_client: "Minio" = Depends(depends_minio),
+    settings: AppConfig = Depends(get_appconfig),
 ) -> Response:
-    """Get logging messages from a task."""
-    return Response(content=response.data, media_type="text/plain")
+    """Get logging messages from a task.
+
+    Only the messages after the `cursor` are returned, while the cursor for
+    the next read is given in the `X-Next-Cursor`-header. In follow-mode, new
+    messages are streamed until the task is finished or `limit` bytes
+    were sent."""
+    if logs.query.follow:
+        return StreamingResponse(
+            follow_logs(
+                logs, celery_app, redis, minio_client, settings.log_flush_interval
+            ),
+            media_type="text/plain",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    return Response(
+        content=logs.content,
+        media_type="text/plain",
+        headers={"X-Next-Cursor": logs.cursor or ""},
+    )
+
+
+@app.post("/transformations/states", operation_id="getTransformationStates")
+async def get_states(
+    body: TaskStatesBody,
+    celery_app: "Celery" = Depends(get_app),
+    redis=Depends(depends_redis),
+) -> TaskStatesModel:
+    """Fetch the states of several submitted tasks at once"""
+    metas = await fetch_task_meta(
+        [str(task_id) for task_id in body.ids], celery_app, redis
+    )
+    return TaskStatesModel(states=[TaskStateModel.from_meta(meta) for meta in metas])
+
+
+@app.get(
+    "/transformations/{transformation_id}/events",
+    operation_id="getTransformationEvents",
+)
+async def get_events(
+    transformation_id: str,
+    celery_app: "Celery" = Depends(get_app),
+    redis=Depends(depends_redis),
+    settings: AppConfig = Depends(get_appconfig),
+) -> StreamingResponse:
+    """Stream state changes and workflow progress of a task as server-sent events"""
+    return StreamingResponse(
+        iter_events(transformation_id, celery_app, redis, settings.events_keepalive),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get(
     "/transformations/{transformation_id}/state", operation_id="getTransformationState"
 )
 async def get_status(
-    transformation_id: str = Query(..., title="task id of the job to be killed"),
-    celery_app: "Celery" = Depends(get_app),
+    meta: Dict[str, Any] = Depends(depends_task_meta),
 ) -> TaskStatusModel:
     """Fetch the status of a submitted task with certain id"""
-    task = celery_app.AsyncResult(transformation_id)
-    return TaskStatusModel(
-        status=task.status,
-        state=task_to_transformation_map[task.state],
-        traceback=task.traceback,
-        id=task.id,
-        args=task.args,
-        kwargs=task.kwargs,
-        date_done=task.date_done,
-    )
+    return TaskStatusModel.from_meta(meta)
 
 
 @app.get("/transformations/{transformation_id}", operation_id="getTransformation")
 async def get_result(
     transformation_id: str = Query(..., title="task id of the submitted job"),
-    celery_app: "Celery" = Depends(get_app),
+    meta: Dict[str, Any] = Depends(depends_task_meta),
 ) -> TaskResultModel:
     """Return the results for submitted task with a certain id"""
-    result = celery_app.AsyncResult(transformation_id)
-    if not result.ready():
+    if meta["status"] not in states.READY_STATES:
         raise HTTPException(status_code=400, detail="Task is not ready yet.")
     return TaskResultModel(
-        parameters=result.result,
+        parameters=meta.get("result"),
         id=transformation_id,
-        traceback=result.traceback,
-        date_done=result.date_done,
+        traceback=meta.get("traceback"),
+        date_done=meta.get("date_done"),
     )
 
 
@@ -328,6 +461,14 @@ async def download_error_handler(request, exc):  # pylint: disable=unused-argume
     return JSONResponse(status_code=422, content="Error while fetching the resource")
 
 
+@app.exception_handler(MinioDownloadError)
+async def missing_object_handler(request, exc):  # pylint: disable=unused-argument
+    """Return response based on the MinioDownloadError"""
+    return JSONResponse(
+        status_code=404, content="The requested resource does not exist."
+    )
+
+
 @app.exception_handler(UploadNotEnabledError)
 async def upload_error_handler(request, exc):  # pylint: disable=unused-argument
     """Return response based on the MinioDownloadError"""
@@ -355,11 +496,19 @@ async def on_startup() -> None:
     await config_plugin.init()
     await redis_plugin.init_app(app, config=config)
     await redis_plugin.init()
+    # build the registry of models and open the connection pool to MinIO
+    # once for the lifetime of the app
+    get_model_info()
+    get_minio()
+    # follow the events of the workers instead of inspecting them per request
+    get_worker_registry().start()
 
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
     """Define functions for app during shutdown"""
+    get_worker_registry().stop()
+    clients.clear()
     await redis_plugin.terminate()
     await config_plugin.terminate()
 
@@ -1,11 +1,13 @@
 """Pydantic Models for FastAPI-celery"""
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, List, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional, Union
 from uuid import UUID
 
 from pydantic import BaseModel, Field
 
+from osp.utilities.formats import GraphFormat
+
 
 class RemoteWorker(str):
     """Identifier of the remote celery worker."""
@@ -27,6 +29,8 @@ class TaskStatus(str, Enum):
     """Status of the task."""
 
     PENDING = "PENDING"
+    STARTED = "STARTED"
+    RETRY = "RETRY"
     SUCCESS = "SUCCESS"
     FAILURE = "FAILURE"
     REVOKED = "REVOKED"
@@ -44,19 +48,29 @@ class TransformationStatus(str, Enum):
 
 task_to_transformation_map = {
     TaskStatus.PENDING: TransformationStatus.RUNNING,
+    TaskStatus.STARTED: TransformationStatus.RUNNING,
+    TaskStatus.RETRY: TransformationStatus.RUNNING,
     TaskStatus.SUCCESS: TransformationStatus.COMPLETED,
     TaskStatus.FAILURE: TransformationStatus.FAILED,
     TaskStatus.REVOKED: TransformationStatus.STOPPED,
 }
 
 
+def get_transformation_status(status: str) -> TransformationStatus:
+    """Map the state of a task onto the status of the transformation, where
+    states like `RECEIVED` or custom progress-states count as running."""
+    return task_to_transformation_map.get(status, TransformationStatus.RUNNING)
+
+
 UpdateTaskStates = Literal[TransformationStatus.RUNNING, TransformationStatus.STOPPED]
 
 
 class TaskStatusModel(BaseModel):
     """Data model of the task status"""
 
-    status: TaskStatus = Field(..., description="Status of the remote task.")
+    status: Union[TaskStatus, str] = Field(
+        ..., description="Status of the remote task."
+    )
     state: TransformationStatus = Field(..., description="State of the remote task.")
     id: UUID = Field(..., description="UUID of the submitted task.")
     args: Optional["List[Any]"] = Field(
@@ -72,6 +86,61 @@ class TaskStatusModel(BaseModel):
         ..., description="Datetime when the submitted job finished."
     )
 
+    @classmethod
+    def from_meta(cls, meta: "Dict[str, Any]", **kwargs) -> "TaskStatusModel":
+        """Create the model from the metadata of the task in the result backend."""
+        return cls(
+            status=meta["status"],
+            state=get_transformation_status(meta["status"]),
+            id=meta["task_id"],
+            args=meta.get("args"),
+            kwargs=meta.get("kwargs"),
+            traceback=meta.get("traceback"),
+            date_done=meta.get("date_done"),
+            **kwargs,
+        )
+
+
+class TaskStateModel(BaseModel):
+    """Compact data model of the task status for batch requests"""
+
+    id: UUID = Field(..., description="UUID of the submitted task.")
+    status: Union[TaskStatus, str] = Field(
+        ..., description="Status of the remote task."
+    )
+    state: TransformationStatus = Field(..., description="State of the remote task.")
+    date_done: Optional[datetime] = Field(
+        ..., description="Datetime when the submitted job finished."
+    )
+
+    @classmethod
+    def from_meta(cls, meta: "Dict[str, Any]") -> "TaskStateModel":
+        """Create the model from the metadata of the task in the result backend."""
+        return cls(
+            id=meta["task_id"],
+            status=meta["status"],
+            state=get_transformation_status(meta["status"]),
+            date_done=meta.get("date_done"),
+        )
+
+
+class TaskStatesBody(BaseModel):
+    """Body of the request for the states of several tasks."""
+
+    ids: List[UUID] = Field(
+        ...,
+        max_items=1000,
+        description="UUIDs of the submitted tasks.",
+    )
+
+
+class TaskStatesModel(BaseModel):
+    """Response of the API with the states of several tasks."""
+
+    states: List[TaskStateModel] = Field(
+        ..., description="States of the tasks in the order of the request."
+    )
+
 
 class TaskKillModel(TaskStatusModel):
     """Response model of the API when process of the task is killed."""
@@ -118,6 +187,19 @@ class RegisteredTaskModel(BaseModel):
     registered_tasks: Dict[RemoteWorker, List[RemoteTaskName]] = Field(
         ..., description="Registry with tasks available on remote workers."
     )
+    last_seen: Dict[RemoteWorker, datetime] = Field(
+        {}, description="Datetime of the last heartbeat of the remote workers."
+    )
+    updated: Optional[datetime] = Field(
+        None, description="Datetime when all remote workers were inspected last."
+    )
+    stale: bool = Field(
+        False,
+        description="Whether the registry is older than its time-to-live.",
+    )
+    ttl: Optional[float] = Field(
+        None, description="Time-to-live of the registry in seconds."
+    )
 
 
 class TaskCreateModel(BaseModel):
@@ -142,8 +224,30 @@ class SubmissionBody(BaseModel):
 
     state: UpdateTaskStates
 
-    format: str = Field(
-        "turtle", description="Format of the RDF-file to be consumed by the worker."
+    format: GraphFormat = Field(
+        GraphFormat.TURTLE,
+        description="""Format of the RDF-files exchanged between the workers,
+        e.g. `nt` (N-Triples) which is parsed considerably faster than Turtle.""",
+    )
+
+    use_cache: bool = Field(
+        True,
+        description="""Whether results of previous calculations
+        with identical inputs may be reused.""",
+    )
+
+    resume: bool = Field(
+        False,
+        description="""Whether a workflow should be resumed from the steps which
+        did not finish during the previous submission of the transformation.""",
+    )
+
+    priority: Optional[int] = Field(
+        None,
+        ge=0,
+        le=9,
+        description="""Priority of the transformation from 0 (lowest) to 9 (highest),
+        e.g. for short interactive runs. Defaults to the priority of the service.""",
     )
 
     class Config:
@@ -153,10 +257,77 @@ class SubmissionBody(BaseModel):
             "example": {
                 "state": "RUNNING",
                 "format": "turtle",
+                "use_cache": True,
+                "resume": False,
             }
         }
 
 
+class TaskOptions(BaseModel):
+    """Options of the tasks running the wrappers, passed as keyword arguments."""
+
+    store_tarball: bool = Field(
+        True, description="Whether the tarball of the wrapper is stored."
+    )
+    use_cache: bool = Field(
+        True, description="Whether cached results of identical inputs are reused."
+    )
+    resume: bool = Field(
+        False, description="Whether a workflow resumes from its journaled steps."
+    )
+    graph_format: GraphFormat = Field(
+        GraphFormat.TURTLE, description="Format of the exchanged RDF-files."
+    )
+    priority: Optional[int] = Field(
+        None, description="Priority of the broker for the steps of a workflow."
+    )
+
+
+class QueueDepthModel(BaseModel):
+    """Response of the API with the depths of the queues in the broker."""
+
+    queues: Dict[str, int] = Field(
+        ..., description="Number of tasks waiting in the queues of the workers."
+    )
+    max_depth: int = Field(
+        ..., description="Depth of a queue beyond which submissions are rejected."
+    )
+    saturated: bool = Field(
+        ..., description="Whether submissions are currently rejected."
+    )
+    inflight: int = Field(
+        ..., description="Number of transformations of the owner which are not ready."
+    )
+    max_inflight: int = Field(
+        ..., description="Quota of transformations of the owner in flight."
+    )
+
+
+class LogsQuery(BaseModel):
+    """Query of the logging messages of a task."""
+
+    cursor: Optional[str] = Field(
+        None, description="Position after the logging messages of a previous read."
+    )
+    limit: int = Field(
+        0, ge=0, description="Maximum number of bytes returned. All if set to 0."
+    )
+    follow: bool = Field(
+        False, description="Whether new logging messages are streamed."
+    )
+
+
+class LogsPage(BaseModel):
+    """Logging messages of a task read for a query."""
+
+    task_id: str = Field(..., description="UUID of the submitted task.")
+    content: bytes = Field(..., description="Logging messages after the cursor.")
+    cursor: Optional[str] = Field(
+        None, description="Position after the logging messages of this read."
+    )
+    query: LogsQuery = Field(..., description="Query of the logging messages.")
+
+
 class UploadDataResponse(BaseModel):
     """Body of the data upload response"""
 
@@ -166,6 +337,10 @@ class UploadDataResponse(BaseModel):
 
     last_modified: str = Field(..., description="created time of the data.")
 
+    checksum: Optional[str] = Field(
+        None, description="Content-hash of the data computed during the upload."
+    )
+
 
 class InfoType(str, Enum):
     """Types of information to be returned from app"""
@@ -0,0 +1,154 @@
+"""Registry of remote workers and their tasks maintained from celery-events"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, Dict, List, Optional
+
+    from celery import Celery
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class WorkerRegistry:
+    """Cache of the tasks registered on the remote workers.
+
+    Inspecting the workers broadcasts to all of them and waits for the
+    full reply timeout. The registry hence inspects only once for every
+    `ttl` seconds and for workers newly coming online, while a background
+    thread follows the heartbeat- and online/offline-events of the workers.
+    Workers without a heartbeat for longer than `ttl` are dropped."""
+
+    def __init__(self, celery_app: "Celery", ttl: float = 60.0):
+        """Initialize the registry for the celery app."""
+        self._app = celery_app
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._workers = _Workers()
+        self._stopping = threading.Event()
+        self._receiver = None
+        self._threads: "List[threading.Thread]" = []
+
+    def start(self) -> None:
+        """Start the threads following the events and refreshing the registry."""
+        if self._threads:
+            return
+        self._stopping.clear()
+        for name, target in (
+            ("worker-registry-events", self._follow_events),
+            ("worker-registry-refresh", self._refresh_periodically),
+        ):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stop the background threads."""
+        self._stopping.set()
+        if self._receiver is not None:
+            self._receiver.should_stop = True
+        for thread in self._threads:
+            thread.join(timeout=self._ttl)
+        self._threads = []
+
+    def snapshot(self) -> "Dict[str, Any]":
+        """Return the registered tasks of the workers alive and the staleness."""
+        now = time.time()
+        with self._lock:
+            updated = self._workers.updated
+            alive = {
+                worker: seen
+                for worker, seen in self._workers.last_seen.items()
+                if now - seen <= self._ttl
+            }
+            return {
+                "registered_tasks": {
+                    worker: list(self._workers.tasks.get(worker, []))
+                    for worker in alive
+                },
+                "last_seen": {
+                    worker: _as_datetime(seen) for worker, seen in alive.items()
+                },
+                "updated": _as_datetime(updated),
+                "stale": updated is None or now - updated > self._ttl,
+                "ttl": self._ttl,
+            }
+
+    def refresh(self, destination: "Optional[List[str]]" = None) -> None:
+        """Inspect the registered tasks of all or the given workers."""
+        inspect = self._app.control.inspect(destination=destination)
+        registry = inspect.registered_tasks() or {}
+        now = time.time()
+        with self._lock:
+            if destination is None:
+                self._workers.tasks = {}
+                self._workers.updated = now
+            for worker, tasks in registry.items():
+                self._workers.tasks[worker] = list(tasks)
+                self._workers.last_seen[worker] = now
+
+    def _refresh_periodically(self) -> None:
+        """Inspect all workers once for every time-to-live."""
+        while not self._stopping.is_set():
+            try:
+                self.refresh()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Could not refresh the worker registry: %s", error)
+            self._stopping.wait(self._ttl)
+
+    def _follow_events(self) -> None:
+        """Consume the events of the workers until the registry is stopped."""
+        handlers = {
+            "worker-online": self._on_heartbeat,
+            "worker-heartbeat": self._on_heartbeat,
+            "worker-offline": self._on_offline,
+        }
+        while not self._stopping.is_set():
+            try:
+                with self._app.connection_for_read() as connection:
+                    self._receiver = self._app.events.Receiver(
+                        connection, handlers=handlers
+                    )
+                    self._receiver.capture(limit=None, timeout=None, wakeup=False)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Lost the connection for worker events: %s", error)
+                self._stopping.wait(1.0)
+
+    def _on_heartbeat(self, event: "Dict[str, Any]") -> None:
+        """Mark the worker as alive and inspect it if it is unknown yet."""
+        worker = event["hostname"]
+        with self._lock:
+            known = worker in self._workers.tasks
+            self._workers.tasks.setdefault(worker, [])
+            self._workers.last_seen[worker] = event.get("timestamp") or time.time()
+        if not known or event["type"] == "worker-online":
+            try:
+                self.refresh(destination=[worker])
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Could not inspect worker %s: %s", worker, error)
+
+    def _on_offline(self, event: "Dict[str, Any]") -> None:
+        """Remove the worker from the registry."""
+        with self._lock:
+            self._workers.tasks.pop(event["hostname"], None)
+            self._workers.last_seen.pop(event["hostname"], None)
+
+
+class _Workers:
+    """Registered tasks and last heartbeats of the workers, guarded by the
+    lock of the registry."""
+
+    def __init__(self):
+        self.tasks: "Dict[str, List[str]]" = {}
+        self.last_seen: "Dict[str, float]" = {}
+        self.updated: "Optional[float]" = None
+
+
+def _as_datetime(timestamp: "Optional[float]") -> "Optional[datetime]":
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
@@ -0,0 +1,109 @@
+"""Content-addressed cache of the results of celery-tasks"""
+import hashlib
+import json
+import logging
+import sys
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from rdflib import Graph
+from rdflib.compare import to_canonical_graph
+from rdflib.util import guess_format
+
+from osp.utilities import get_minio
+from osp.utilities.exceptions import MinioDownloadError
+from osp.utilities.helper import _get_stat
+from osp.utilities.lifecycle import pin_objects, touch_object
+
+# `packages_distributions` is only part of the standard library from python 3.10
+if sys.version_info >= (3, 10):
+    from importlib import metadata
+else:  # pragma: no cover
+    import importlib_metadata as metadata
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional
+
+    from redis import Redis
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+RESULT_CACHE_PREFIX = "reaxpro:result-cache:"
+
+
+def graph_digest(path: str, *salt: str) -> str:
+    """Return the hash of the canonicalized RDF-graph in the file and the salt.
+
+    Blank nodes are relabeled and the triples are sorted, such that equal
+    graphs have the same hash regardless of their serialization."""
+    graph = Graph()
+    graph.parse(path, format=guess_format(path) or "turtle")
+    triples = to_canonical_graph(graph).serialize(format="nt")
+    if isinstance(triples, bytes):
+        triples = triples.decode()
+    content = "\n".join(sorted(line for line in triples.splitlines() if line))
+    digest = hashlib.sha256()
+    for item in salt:
+        digest.update(item.encode())
+        digest.update(b"\0")
+    digest.update(content.encode())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def wrapper_version(module: str) -> str:
+    """Return the versions of the distributions providing the module of a wrapper.
+
+    Since `osp` is a namespace package, all distributions providing it are
+    considered, so that updating any of them invalidates the cached results."""
+    top_level = module.split(".")[0]
+    try:
+        distributions = metadata.packages_distributions().get(top_level, [])
+    except AttributeError:  # importlib_metadata < 3.6
+        distributions = []
+    versions = [
+        f"{name}=={metadata.version(name)}" for name in sorted(set(distributions))
+    ]
+    if not versions:
+        versions = [str(getattr(sys.modules.get(module), "__version__", ""))]
+    return ",".join(versions)
+
+
+def get_cached_result(client: "Redis", digest: str) -> "Optional[Dict[str, Any]]":
+    """Return a previous result for the digest if its objects are still cached."""
+    cached = client.get(RESULT_CACHE_PREFIX + digest)
+    if not cached:
+        return None
+    entry = json.loads(cached)
+    if "result" not in entry or "objects" not in entry:
+        # entries of previous versions only tell the graph as object
+        entry = {"result": entry, "objects": [entry["cache_meta"]]}
+    minio_client = get_minio()
+    try:
+        for key in entry["objects"]:
+            _get_stat(key, minio_client)
+    except MinioDownloadError:
+        logger.info("Cached result %s has been evicted from the cache.", digest)
+        client.delete(RESULT_CACHE_PREFIX + digest)
+        return None
+    for key in entry["objects"]:
+        touch_object(key)
+    return entry["result"]
+
+
+def set_cached_result(
+    client: "Redis",
+    digest: str,
+    result: "Dict[str, Any]",
+    objects: "List[str]",
+    ttl: int,
+) -> None:
+    """Store the result of a task for the digest of its inputs, whose objects
+    in the cache are pinned as long as the result is stored."""
+    client.set(
+        RESULT_CACHE_PREFIX + digest,
+        json.dumps({"result": result, "objects": objects}),
+        ex=ttl,
+    )
+    pin_objects(ttl, *objects)
@@ -1,45 +1,293 @@
 """S3Handler for logging of celery-tasks"""
+import itertools
 import logging
+import threading
+import time
+from functools import partial
+from typing import Callable, List, Optional, Tuple
 
+from minio import Minio
+from minio.error import S3Error
+
+from osp.settings import AppConfig, get_settings
 from osp.utilities import get_boto3, get_minio
+from osp.utilities.exceptions import MinioDownloadError
+from osp.utilities.layout import MISSING_CODES, get_layout
+from osp.utilities.lifecycle import next_log_sequence
 
+# time in seconds for which a missing chunk of the logs is awaited, since
+# chunks of several writers may become visible out of order
+LOG_GAP_GRACE = 60.0
 
-class S3Handler(logging.Handler):
-    """Logging handler related to the S3-client"""
 
-    def __init__(self, task_id, s3_client):
-        """Initalize the class with the bucket name and key."""
-        super().__init__()
-        self._task_id = task_id
+class LogShipper:
+    """Uploader of the chunks of logging records of a task via the S3-client.
+
+    Chunks are stored as separate, numbered objects below the prefix of the
+    task. The numbers are drawn from `sequence`, which is shared by all
+    shippers (e.g. of the head worker and the workers of the single workflow
+    steps) writing into the logs of the same task, such that they do not
+    overwrite each other and readers can continue after the last chunk read."""
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        prefix: str,
+        sequence: Optional[Callable[[], int]] = None,
+    ):
         self._s3_client = s3_client
+        self._location = bucket, prefix
+        self._sequence = sequence or partial(next, itertools.count(1))
+        self._retry_key: Optional[str] = None
+        # serializes the shipping, such that chunks are numbered in order
+        self.lock = threading.Lock()
 
-    def emit(self, record):
-        """Emit the record and push object to minio via S3-client."""
-        log_entry = self.format(record)
+    @property
+    def prefix(self) -> str:
+        """Return the prefix of the chunks of the task."""
+        return self._location[1]
+
+    def ship(self, entries: List[str]) -> bool:
+        """Upload the records as the next chunk and return whether it succeeded.
+
+        A failed chunk is retried under its number, not leaving a gap."""
+        bucket, prefix = self._location
+        chunk_key = self._retry_key or f"{prefix}{self._sequence():020d}"
+        self._retry_key = chunk_key
         try:
-            existing_object = self._s3_client.get_object(
-                Bucket=self._task_id, Key=self._task_id
+            self._s3_client.put_object(
+                Bucket=bucket, Key=chunk_key, Body="".join(entries).encode()
             )
-            existing_logs = existing_object["Body"].read().decode()
-        except Exception:
-            existing_logs = ""
+        except Exception:  # pylint: disable=broad-except
+            return False
+        self._retry_key = None
+        return True
+
+
+class S3Handler(logging.Handler):
+    """Logging handler shipping buffered records as chunks via a `LogShipper`.
 
-        updated_logs = existing_logs + log_entry + "\n"
+    Records are collected in memory and shipped by a background thread,
+    either when `log_flush_size` bytes are buffered or after
+    `log_flush_interval` seconds due to the settings."""
 
-        self._s3_client.put_object(
-            Bucket=self._task_id,
-            Key=self._task_id,
-            Body=updated_logs.encode(),
+    def __init__(self, shipper: LogShipper, settings: Optional[AppConfig] = None):
+        """Initalize the class with the shipper of the logs and the settings."""
+        super().__init__()
+        self._shipper = shipper
+        self._settings = settings or get_settings()
+        self._buffer: List[str] = []
+        self._buffer_size = 0
+        self._wakeup = threading.Event()
+        self._closing = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"s3-logs-{shipper.prefix}", daemon=True
         )
+        self._thread.start()
+
+    def emit(self, record):
+        """Buffer the record and wake up the shipping thread if necessary."""
+        try:
+            log_entry = self.format(record) + "\n"
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        self._buffer.append(log_entry)
+        self._buffer_size += len(log_entry)
+        if self._buffer_size >= self._settings.log_flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Ship all buffered records to minio via S3-client."""
+        with self._shipper.lock:
+            self.acquire()
+            try:
+                entries, self._buffer = self._buffer, []
+                self._buffer_size = 0
+            finally:
+                self.release()
+            if not entries or self._shipper.ship(entries):
+                return
+            # keep the records for the next attempt
+            self.acquire()
+            try:
+                self._buffer = entries + self._buffer
+                self._buffer_size += sum(len(entry) for entry in entries)
+            finally:
+                self.release()
+
+    def close(self):
+        """Stop the shipping thread and ship the remaining records."""
+        self._closing.set()
+        self._wakeup.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        super().close()
+
+    def _run(self):
+        """Ship the buffered records periodically until the handler is closed."""
+        while not self._closing.is_set():
+            self._wakeup.wait(self._settings.log_flush_interval)
+            self._wakeup.clear()
+            self.flush()
 
 
 def get_s3handler(task_id: str) -> S3Handler:
     """Get S3 handler for logging."""
-    minio_client = get_minio()
-    if not minio_client.bucket_exists(task_id):
-        minio_client.make_bucket(task_id)
-    s3_client = get_boto3()
-    return S3Handler(
-        task_id,
-        s3_client,
+    settings = get_settings()
+    layout = get_layout()
+    shipper = LogShipper(
+        get_boto3(),
+        layout.prepare(task_id, get_minio()),
+        layout.locate_logs(task_id)[1],
+        sequence=partial(
+            next_log_sequence, task_id, settings.cache_ttl or settings.journal_ttl
+        ),
     )
+    return S3Handler(shipper, settings)
+
+
+def read_logs(
+    task_id: str,
+    minio_client: Minio,
+    cursor: Optional[str] = None,
+    length: int = 0,
+    final: bool = False,
+) -> Tuple[bytes, Optional[str]]:
+    """Read the logging messages of a task after a cursor.
+
+    The cursor names the last chunk read and the number of bytes read from
+    it, such that chunks becoming visible late do not shift the position.
+    Up to `length` bytes are returned if given. A missing chunk stops the
+    read until it shows up or `LOG_GAP_GRACE` seconds passed, unless the
+    logs are `final`. Return the content and the cursor of the next read."""
+    bucket, chunks = _list_chunks(task_id, minio_client)
+    if not chunks:
+        raise MinioDownloadError("Logs do not exist.")
+    spans, cursor = _plan_read(chunks, cursor, length, final)
+    content = []
+    for name, start, span in spans:
+        response = minio_client.get_object(bucket, name, offset=start, length=span)
+        try:
+            content.append(response.read())
+        finally:
+            response.close()
+            response.release_conn()
+    return b"".join(content), cursor
+
+
+def _plan_read(
+    chunks: "List[Tuple[str, str, int, float]]",
+    cursor: Optional[str],
+    length: int,
+    final: bool,
+) -> "Tuple[List[Tuple[str, int, int]], Optional[str]]":
+    """Return the object name, offset and length of the spans of the chunks
+    to be read after the cursor, and the cursor after reading them."""
+    last, position = _parse_cursor(cursor)
+    remaining = length or None
+    spans = []
+    for name, chunk, size, modified in chunks:
+        if last is not None and _order(chunk) < _order(last):
+            continue
+        if chunk == last:
+            start = position
+        elif (
+            not final
+            and _is_gap(last, chunk)
+            and time.time() - modified < LOG_GAP_GRACE
+        ):
+            break
+        else:
+            start = 0
+        span = max(size - start, 0)
+        if remaining is not None:
+            span = min(span, remaining)
+            remaining -= span
+        if span:
+            spans.append((name, start, span))
+        last, position = chunk, start + span
+        if remaining == 0:
+            break
+    return spans, _format_cursor(last, position)
+
+
+def _order(chunk: str) -> "Tuple[bool, str]":
+    """Return the key sorting the chunks written by earlier versions, which are
+    not numbered, in front of the numbered ones."""
+    return chunk.isdigit(), chunk
+
+
+def _parse_cursor(cursor: Optional[str]) -> Tuple[Optional[str], int]:
+    if not cursor:
+        return None, 0
+    chunk, _, position = cursor.rpartition(":")
+    try:
+        return chunk, int(position)
+    except ValueError as error:
+        raise ValueError(f"Invalid cursor of logs: {cursor}") from error
+
+
+def _format_cursor(chunk: Optional[str], position: int) -> Optional[str]:
+    return None if chunk is None else f"{chunk}:{position}"
+
+
+def _is_gap(last: Optional[str], chunk: str) -> bool:
+    """Whether chunks numbered before the given one were not read yet.
+
+    Chunks written by earlier versions are not numbered and never missing."""
+    if not chunk.isdigit() or not (last is None or last.isdigit()):
+        return False
+    return int(chunk) != (int(last) if last else 0) + 1
+
+
+def _list_chunks(
+    task_id: str, minio_client: Minio
+) -> "Tuple[str, List[Tuple[str, str, int, float]]]":
+    """Return the bucket and the sorted logging chunks, each with its object
+    name, its name relative to the prefix, its size and modification time.
+
+    Logs missing in the configured layout are looked up in the legacy
+    layout with one bucket per task, which also contains the logs written
+    as single object by earlier versions."""
+    layout = get_layout()
+    locations = []
+    if layout.bucket:
+        locations.append(layout.locate_logs(task_id))
+    if layout.fallback or not layout.bucket:
+        locations.append((task_id, None))
+    for bucket, prefix in locations:
+        try:
+            chunks = [
+                (
+                    item.object_name,
+                    _relative_name(item.object_name, prefix or f"{task_id}/"),
+                    item.size,
+                    item.last_modified.timestamp(),
+                )
+                for item in minio_client.list_objects(
+                    bucket, prefix=prefix, recursive=True
+                )
+            ]
+        except S3Error as error:
+            if error.code not in MISSING_CODES:
+                raise
+            continue
+        if chunks:
+            return bucket, sorted(chunks, key=lambda item: _order(item[1]))
+    return locations[0][0], []
+
+
+def _relative_name(name: str, prefix: str) -> str:
+    return name[len(prefix) :] if name.startswith(prefix) else name
+
+
+def get_logs(task_id: str, minio_client: Minio) -> bytes:
+    """Concatenate the logging chunks of a task in chronological order.
+
+    Logs written by previous versions as a single object with the
+    task id as key are sorted in front of the chunks."""
+    content, _ = read_logs(task_id, minio_client, final=True)
+    return content
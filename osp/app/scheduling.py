@@ -0,0 +1,277 @@
+"""Priorities, fair share and admission of the transformations of the owners"""
+import base64
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, Optional
+from uuid import uuid4
+
+from celery import states
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from osp.settings import AppConfig
+
+from .backend import fetch_task_meta
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Any, Dict, Iterable, List
+
+    from celery import Celery
+    from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# priorities of the API range from 0 (lowest) to 9 (highest), while the
+# redis-broker serves its sub-queue for the priority 0 first
+MAX_PRIORITY = 9
+PRIORITY_STEPS = list(range(MAX_PRIORITY + 1))
+
+# separator of the sub-queues for the priorities in the redis-transport of kombu
+PRIORITY_SEP = "\x06\x16"
+
+OWNER_PREFIX = "reaxpro:owner:"
+OWNERS_KEY = "reaxpro:owners"
+ANONYMOUS = "anonymous"
+
+
+def owner_key(owner: str) -> str:
+    """Return the Redis-key of the transformations submitted by an owner."""
+    return OWNER_PREFIX + owner
+
+
+def to_broker_priority(priority: int) -> int:
+    """Convert a priority of the API into the priority of the redis-broker."""
+    return MAX_PRIORITY - min(max(priority, 0), MAX_PRIORITY)
+
+
+def fair_priority(priority: int, rank: int) -> int:
+    """Lower the priority by the rank of the owner due to its transformations in
+    flight, such that owners with few transformations overtake the others.
+
+    The priority is fixed when a transformation is submitted and only
+    orders it relative to the transformations waiting in the queue then."""
+    return max(priority - rank, 0)
+
+
+async def owner_rank(owner: str, inflight: int, redis: "Redis", max_age: int) -> int:
+    """Record the number of transformations of the owner in flight and return
+    its rank relative to the other owners, i.e. 0 without transformations in
+    flight and otherwise 1 plus the number of owners with fewer in flight.
+
+    The penalty hence grows with the number of owners instead of the backlog
+    of one owner, such that the priority of an owner alone is only lowered by
+    1 and that of the busiest of `n` owners by `n`. The numbers of the other
+    owners are recorded when they submit, and may include transformations
+    which finished since."""
+    if not inflight:
+        await redis.zrem(OWNERS_KEY, owner)
+        return 0
+    await redis.zadd(OWNERS_KEY, {owner: inflight})
+    if max_age:
+        await redis.expire(OWNERS_KEY, max_age)
+    return 1 + await redis.zcount(OWNERS_KEY, "-inf", f"({inflight}")
+
+
+def get_owner(authorization: Optional[str], strict: bool = False) -> str:
+    """Return the subject of the JWT in the `Authorization`-header.
+
+    The token is validated by the `AuthTokenBearer` before, hence its claims
+    are only decoded here. Requests without token or with a token without
+    subject are owned by `anonymous`, unless `strict` rejects them with
+    status 401, e.g. if quotas or fair share are enabled for the owners."""
+    claims: "Dict[str, Any]" = {}
+    if authorization and authorization.startswith("Bearer "):
+        try:
+            payload = authorization[len("Bearer ") :].split(".")[1]
+            claims = json.loads(
+                base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+            )
+        except (IndexError, ValueError) as error:
+            logger.warning("Could not decode the claims of the token: %s", error)
+    owner = isinstance(claims, dict) and (
+        claims.get("sub") or claims.get("preferred_username")
+    )
+    if owner:
+        return str(owner)
+    if strict:
+        raise HTTPException(
+            status_code=401,
+            detail="The token does not identify its owner by a JWT-subject.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return ANONYMOUS
+
+
+async def count_inflight(
+    owner: str, celery_app: "Celery", redis: "Redis", max_age: int
+) -> int:
+    """Return the number of transformations of the owner which are not ready.
+
+    Ready transformations and those submitted more than `max_age` seconds ago
+    are dropped from the record of the owner."""
+    key = owner_key(owner)
+    if max_age:
+        await redis.zremrangebyscore(key, "-inf", time.time() - max_age)
+    task_ids = [
+        task_id.decode() if isinstance(task_id, bytes) else task_id
+        for task_id in await redis.zrange(key, 0, -1)
+    ]
+    metas = await fetch_task_meta(task_ids, celery_app, redis)
+    ready = [meta["task_id"] for meta in metas if meta["status"] in states.READY_STATES]
+    if ready:
+        await redis.zrem(key, *ready)
+    return len(task_ids) - len(ready)
+
+
+async def reserve_submission(
+    owner: str, task_id: str, redis: "Redis", max_age: int
+) -> int:
+    """Record a transformation of the owner before it is submitted and return
+    the number of transformations of the owner in flight before it.
+
+    The record and the count are taken atomically, such that concurrent
+    submissions of an owner are counted one after the other. Rejected or
+    failed submissions need to be released by `release_submission`."""
+    key = owner_key(owner)
+    pipeline = redis.pipeline(transaction=True)
+    pipeline.zadd(key, {task_id: time.time()})
+    pipeline.zcard(key)
+    if max_age:
+        pipeline.expire(key, max_age)
+    results = await pipeline.execute()
+    return results[1] - 1
+
+
+async def release_submission(owner: str, task_id: str, redis: "Redis") -> None:
+    """Drop the record of a transformation of the owner which was not submitted."""
+    await redis.zrem(owner_key(owner), task_id)
+
+
+def get_queues(worker_name: str, worker_mapping: str) -> "List[str]":
+    """Return the queues of the head worker and of the workers in the mapping."""
+    queues = [worker_name]
+    for entry in worker_mapping.split("|"):
+        queue = entry.split(":")[-1].strip()
+        if queue and queue not in queues:
+            queues.append(queue)
+    return queues
+
+
+async def queue_depths(queues: "Iterable[str]", redis: "Redis") -> "Dict[str, int]":
+    """Return the number of messages waiting in the queues of the broker,
+    summed over the sub-queues of all priorities."""
+    queues = list(queues)
+    pipeline = redis.pipeline(transaction=False)
+    for queue in queues:
+        for step in PRIORITY_STEPS:
+            pipeline.llen(f"{queue}{PRIORITY_SEP}{step}" if step else queue)
+    lengths = await pipeline.execute()
+    steps = len(PRIORITY_STEPS)
+    return {
+        queue: sum(lengths[index * steps : (index + 1) * steps])
+        for index, queue in enumerate(queues)
+    }
+
+
+def check_admission(
+    depths: "Dict[str, int]",
+    max_depth: int,
+    inflight: int,
+    max_inflight: int,
+    retry_after: int,
+) -> None:
+    """Reject a submission with status 429 if a queue is saturated or the owner
+    exhausted the quota of transformations in flight. Limits of 0 are disabled."""
+    saturated = [queue for queue, depth in depths.items() if depth >= max_depth]
+    if max_depth and saturated:
+        detail = f"Queues {saturated} are saturated with {max_depth} waiting tasks."
+    elif max_inflight and inflight >= max_inflight:
+        detail = f"Quota of {max_inflight} transformations in flight exhausted."
+    else:
+        return
+    logger.warning("Rejected submission: %s", detail)
+    raise HTTPException(
+        status_code=429, detail=detail, headers={"Retry-After": str(retry_after)}
+    )
+
+
+class Scheduler:
+    """Admission and priority of the transformations submitted by an owner."""
+
+    def __init__(
+        self, owner: str, celery_app: "Celery", redis: "Redis", settings: AppConfig
+    ):
+        self._owner = owner
+        self._celery_app = celery_app
+        self._redis = redis
+        self._settings = settings
+
+    async def submit(
+        self, kwargs: "Dict[str, Any]", priority: Optional[int] = None
+    ) -> str:
+        """Send a transformation to the head worker and return its task id.
+
+        The slot of the owner is reserved before the admission, such that
+        concurrent submissions cannot exceed the quota together. The priority
+        defaults to the one of the service and is lowered by the rank of the
+        owner if fair share is enabled. Raise status 429 if rejected."""
+        settings = self._settings
+        task_id = str(uuid4())
+        # the submissions of the owner are only recorded if counted
+        tracked = settings.fair_share or bool(settings.owner_max_inflight)
+        inflight = 0
+        if tracked:
+            # drop the transformations of the owner which are ready meanwhile
+            await count_inflight(
+                self._owner, self._celery_app, self._redis, settings.inflight_ttl
+            )
+            inflight = await reserve_submission(
+                self._owner, task_id, self._redis, settings.inflight_ttl
+            )
+        try:
+            await self._admit(inflight)
+            broker_priority = to_broker_priority(
+                await self._priority(priority, inflight)
+            )
+            # send the task without blocking the event loop
+            await run_in_threadpool(
+                self._celery_app.send_task,
+                settings.worker_name,
+                task_id=task_id,
+                kwargs={**kwargs, "priority": broker_priority},
+                queue=settings.worker_name,
+                priority=broker_priority,
+            )
+        except BaseException:
+            if tracked:
+                await release_submission(self._owner, task_id, self._redis)
+            raise
+        return task_id
+
+    async def _admit(self, inflight: int) -> None:
+        settings = self._settings
+        depths = {}
+        if settings.queue_max_depth:
+            depths = await queue_depths(
+                get_queues(settings.worker_name, settings.worker_mapping), self._redis
+            )
+        check_admission(
+            depths,
+            settings.queue_max_depth,
+            inflight,
+            settings.owner_max_inflight,
+            settings.admission_retry_after,
+        )
+
+    async def _priority(self, priority: Optional[int], inflight: int) -> int:
+        settings = self._settings
+        if priority is None:
+            priority = settings.default_priority
+        if settings.fair_share:
+            rank = await owner_rank(
+                self._owner, inflight, self._redis, settings.inflight_ttl
+            )
+            priority = fair_priority(priority, rank)
+        return priority
@@ -2,20 +2,32 @@
 
 import logging
 import tempfile
+from contextlib import ExitStack, contextmanager
 from importlib import import_module
 from typing import TYPE_CHECKING
 
-from celery import Celery, current_task, signals
+from celery import Celery, current_task, signals, states
+from celery.canvas import Signature
 
+from osp.app.models import TaskOptions
+from osp.app.results import (
+    get_cached_result,
+    graph_digest,
+    set_cached_result,
+    wrapper_version,
+)
 from osp.app.s3 import get_s3handler
+from osp.app.scheduling import PRIORITY_STEPS, to_broker_priority
 from osp.core.cuds import Cuds
 from osp.core.namespaces import cuba
 from osp.core.utils import export_cuds, import_cuds
-from osp.settings import AppConfig
-from osp.utilities import get_download, get_upload
+from osp.settings import get_settings
+from osp.utilities import get_minio, get_upload
+from osp.utilities.lifecycle import CacheSweeper, get_redis, reference_objects
+from osp.utilities.load import cleanup_tempfiles, downloaded, get_upload_graph
 
 if TYPE_CHECKING:
-    from typing import Callable
+    from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 
 def get_wrapper_class(module: str) -> "Callable":
@@ -24,10 +36,32 @@ def get_wrapper_class(module: str) -> "Callable":
     return getattr(import_module(module), classname)
 
 
-settings = AppConfig()
+settings = get_settings()
 address = settings.get_redis_address()
 celery = Celery(settings.worker_name, broker=address, backend=address)
 celery.conf.CELERYD_HIJACK_ROOT_LOGGER = False
+# publish the STARTED-state, e.g. for the event stream of the API
+celery.conf.task_track_started = True
+# the redis-broker emulates priorities through a sub-queue for every step,
+# which is only effective if the workers do not prefetch further tasks
+celery.conf.broker_transport_options = {"priority_steps": PRIORITY_STEPS}
+celery.conf.task_default_priority = to_broker_priority(settings.default_priority)
+celery.conf.worker_prefetch_multiplier = 1
+
+# name of the task advancing the workflows sent by this worker, must match
+# with `advance_task_name` of the `CeleryWorkflowEngine`
+ADVANCE_TASK = f"{settings.worker_name}.advance"
+
+# the sweeper of the cache is scheduled by the beat of the head worker
+SWEEP_TASK = "reaxpro.sweep_cache"
+if settings.cache_sweep_interval and (settings.cache_ttl or settings.cache_max_bytes):
+    celery.conf.beat_schedule = {
+        "sweep-cache": {
+            "task": SWEEP_TASK,
+            "schedule": settings.cache_sweep_interval,
+            "options": {"queue": settings.worker_name},
+        }
+    }
 
 
 @signals.setup_logging.connect
@@ -49,26 +83,129 @@ def on_setup_logging(**kwargs):  # pylint: disable=unused-argument
     logger.addHandler(console_handler)
 
 
-@celery.task(name=settings.worker_name)
-def run_simulation(
-    cache_key: str = None, task_id: str = None, store_tarball: bool = True
-) -> str:
-    """Run celery-workflow wrapper as celery-task."""
+@signals.worker_process_init.connect
+def on_worker_process_init(**kwargs):  # pylint: disable=unused-argument
+    """Remove temporary files left over by crashed worker processes."""
+    cleanup_tempfiles(settings.tempfile_max_age)
 
-    # Configure the logging module
-    task_id = task_id or current_task.request.id
+
+@contextmanager
+def task_logging(task_id: str) -> "Iterator[None]":
+    """Ship the logging messages within the context into the logs of the task."""
     s3_handler = get_s3handler(task_id)
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
     s3_handler.setFormatter(formatter)
     logging.basicConfig(level=logging.INFO)
     logging.root.addHandler(s3_handler)
+    try:
+        yield
+    finally:
+        # ship the remaining logging records before the task returns
+        logging.root.removeHandler(s3_handler)
+        s3_handler.close()
+
+
+@celery.task(name=settings.worker_name, bind=True)
+def run_simulation(
+    self, cache_key: str = None, task_id: str = None, **options: "Any"
+) -> str:
+    """Run celery-workflow wrapper as celery-task.
+
+    The `options` are the fields of `TaskOptions`. Workflows return the raw
+    results of their steps instead of a tarball, hence `store_tarball` is
+    rejected for wrappers dispatching workflows."""
+
+    # Configure the logging module
+    task_id = task_id or current_task.request.id
+    options = TaskOptions(**options)
+    with task_logging(task_id):
+        # download cuds
+        logging.info("received cache_key %s", cache_key)
+        session_class = _get_session_class(options)
+        with ExitStack() as inputs:
+            cudspath = inputs.enter_context(downloaded(cache_key))
+            # reuse the result of a previous run with an identical input graph,
+            # workflows are not cached themselves but through their single steps
+            digest = _result_digest(session_class, cudspath, options)
+            cached = digest and get_cached_result(self.backend.client, digest)
+            if cached:
+                logging.info("reusing cached result %s for %s", cached, cache_key)
+                reference_objects(task_id, cache_key, *cached.values())
+                return cached
+            session = _run_session(session_class, cache_key, task_id, cudspath, inputs)
 
-    # download cuds
-    logging.info("received cache_key %s", cache_key)
-    cudspath = get_download(cache_key, as_file=True)
+        # upload Cuds, as delta to the input graph if enabled
+        with tempfile.NamedTemporaryFile(suffix=options.graph_format.suffix) as file:
+            export_cuds(session, file.name, format=options.graph_format.value)
+            meta_key = get_upload_graph(file.name, base=cache_key)
+        reference_objects(task_id, cache_key, meta_key)
 
-    # run wrapper
+        # workflows are continued by the remote workers without blocking
+        # this task, which is replaced by the chain of the workflow steps
+        if hasattr(session, "dispatch"):
+            workflow = session.dispatch(
+                meta_key,
+                resume=options.resume,
+                use_cache=options.use_cache,
+                graph_format=options.graph_format.value,
+                priority=options.priority,
+            )
+            if isinstance(workflow, Signature):
+                raise self.replace(workflow)
+            return workflow
+
+        result, objects = _store_result(session, meta_key, options)
+        reference_objects(task_id, result["cache_raw"])
+        if digest:
+            set_cached_result(
+                self.backend.client,
+                digest,
+                result,
+                objects,
+                settings.result_cache_ttl,
+            )
+        return result
+
+
+def _get_session_class(options: TaskOptions) -> "Callable":
+    """Return the class of the wrapper, rejecting options it does not support."""
     session_class = get_wrapper_class(settings.wrapper_name)
+    if options.store_tarball and hasattr(session_class, "dispatch"):
+        raise ValueError(
+            f"`store_tarball` is not supported by the workflows of "
+            f"`{settings.wrapper_name}`, whose steps store their raw results."
+        )
+    return session_class
+
+
+def _result_digest(
+    session_class: "Callable", cudspath: str, options: TaskOptions
+) -> "Optional[str]":
+    """Return the digest of the input graph for the result cache, if enabled."""
+    if (
+        not options.use_cache
+        or not settings.result_cache_ttl
+        or hasattr(session_class, "dispatch")
+    ):
+        return None
+    return graph_digest(
+        cudspath,
+        settings.worker_name,
+        wrapper_version(session_class.__module__),
+        str(options.store_tarball),
+        options.graph_format.value,
+    )
+
+
+def _run_session(
+    session_class: "Callable",
+    cache_key: str,
+    task_id: str,
+    cudspath: str,
+    inputs: ExitStack,
+) -> "Any":
+    """Import the input graph into the wrapper and run it, closing the `inputs`
+    holding the downloaded graph beforehand."""
     with session_class(input_uuid=cache_key, logging_id=task_id) as session:
         wrapper = cuba.Wrapper(session=session)
         cuds = import_cuds(cudspath, session=session)
@@ -76,18 +213,61 @@ def run_simulation(
             wrapper.add(*cuds, rel=cuba.relationship)
         elif isinstance(cuds, Cuds):
             wrapper.add(cuds, rel=cuba.relationship)
+        # release the input graph before the run, which does not pin
+        # it in the on-disk cache of the host for its whole duration
+        inputs.close()
         session.run()
+    return session
+
+
+def _store_result(
+    session: "Any", meta_key: str, options: TaskOptions
+) -> "Tuple[Dict[str, Any], List[str]]":
+    """Return the result of the wrapper and the keys of its objects in the cache,
+    uploading its tarball if requested."""
+    if not options.store_tarball:
+        return {"cache_meta": meta_key, "cache_raw": session.result}, [meta_key]
+    with open(session.tarball, "rb") as tar:
+        tar_key = get_upload(tar)
+    return {"cache_meta": meta_key, "cache_raw": tar_key}, [meta_key, tar_key]
+
+
+@celery.task(name=SWEEP_TASK)
+def sweep_cache() -> "Dict[str, int]":
+    """Evict objects and logs from the cache due to the lifecycle policies."""
+    sweeper = CacheSweeper(
+        get_redis(),
+        get_minio(),
+        get_task_states,
+        ttl=settings.cache_ttl,
+        max_bytes=settings.cache_max_bytes,
+    )
+    return sweeper.sweep()
+
+
+def get_task_states(task_ids: "List[str]") -> "List[str]":
+    """Return the states of the tasks from the result backend at once."""
+    if not task_ids:
+        return []
+    backend = celery.backend
+    metas = backend.client.mget([backend.get_key_for_task(key) for key in task_ids])
+    return [
+        backend.decode_result(meta)["status"] if meta else states.PENDING
+        for meta in metas
+    ]
 
-    # upload Cuds
-    with tempfile.NamedTemporaryFile(suffix=".ttl", delete=False) as file:
-        export_cuds(session, file.name)
-        meta_key = get_upload(file)
 
-    # get tarball keys
-    if store_tarball:
-        with open(session.tarball, "rb") as tar:
-            tar_key = get_upload(tar)
-    else:
-        tar_key = session.result
+@celery.task(name=ADVANCE_TASK, bind=True)
+def advance_workflow(
+    self, result: "Dict[str, Any]", state: "Dict[str, Any]"
+) -> "Dict[str, Any]":
+    """Map the outputs of a finished workflow step and send the next step."""
+    # pylint: disable=import-outside-toplevel
+    from osp.wrappers.celery_workflow_wrapper import CeleryWorkflowEngine
 
-    return {"cache_meta": meta_key, "cache_raw": tar_key}
+    with task_logging(state["logging_id"]):
+        engine = CeleryWorkflowEngine.from_state(state, app=celery)
+        response = engine.advance(result)
+        if isinstance(response, Signature):
+            raise self.replace(response)
+        return response
@@ -1,5 +1,6 @@
 """Pydantic settings for FastAPI and Celery."""
 
+from functools import lru_cache
 from typing import Optional
 
 from fastapi_plugins import RedisSettings
@@ -53,6 +54,37 @@ class AppConfig(RedisSettings):
         "localhost:9000",
         description="Resolvable endpoint to contact MinIO instance.",
     )
+    minio_pool_size: int = Field(
+        10,
+        description="""Maximum number of connections kept open in the pool
+        of the MinIO- and S3-clients of each process.""",
+    )
+    minio_connect_timeout: float = Field(
+        5.0, description="Timeout in seconds for connecting to MinIO instance."
+    )
+    minio_read_timeout: float = Field(
+        300.0, description="Timeout in seconds for reading from MinIO instance."
+    )
+    minio_retries: int = Field(
+        3, description="Number of retries for failed requests to MinIO instance."
+    )
+    cache_bucket: Optional[str] = Field(
+        "reaxpro-cache",
+        description="""Single bucket holding all cached objects and logs below
+        prefixes sharded by their uuid, e.g. `cache/ab/cd/<uuid>`. If not set,
+        the legacy layout with one bucket per object is used.""",
+    )
+    cache_shard_depth: int = Field(
+        2,
+        ge=0,
+        description="""Number of prefix-levels of two characters
+        each for sharding the objects in the cache bucket.""",
+    )
+    cache_legacy_fallback: bool = Field(
+        True,
+        description="""Whether objects missing in the cache bucket are read from
+        the legacy layout with one bucket per object, e.g. after an upgrade.""",
+    )
     external_hostname: Optional[str] = Field(
         None, description="Resolvable hostname to the outside world."
     )
@@ -63,7 +95,186 @@ class AppConfig(RedisSettings):
         the cache should be enabled or not""",
     )
 
+    upload_part_size: int = Field(
+        5242880,
+        ge=5242880,
+        description="""Size in bytes of the parts for streamed multipart-uploads
+        into the cache. Must be at least 5 MiB.""",
+    )
+
+    upload_parallel: int = Field(
+        4,
+        description="""Number of threads uploading the parts
+        of multipart-uploads into the cache in parallel.""",
+    )
+
+    upload_hash_algorithm: Optional[str] = Field(
+        "sha256",
+        description="""Name of the hashlib-algorithm for the content-hash computed
+        during direct uploads into the cache. No hash is computed if not set.""",
+    )
+
+    cache_compression: Optional[str] = Field(
+        "zstd",
+        description="""Codec for compressing objects uploaded into the cache, either
+        `zstd` (falls back to `gzip` if `zstandard` is not installed) or `gzip`.
+        Objects are stored uncompressed if not set, as are files which are
+        compressed already due to their suffix, e.g. `.tar.gz`.""",
+    )
+
+    cache_compression_level: Optional[int] = Field(
+        None, description="Compression level of the codec. Its default if not set."
+    )
+
+    graph_delta: bool = Field(
+        False,
+        description="""Whether graphs exported by the workers are uploaded as the
+        triples added and removed with respect to their input graph, which are
+        reconstructed when downloaded. Graphs with blank nodes are uploaded fully.""",
+    )
+
+    download_chunk_size: int = Field(
+        1048576,
+        description="""Size in bytes of the chunks streamed
+        for downloads from the cache.""",
+    )
+
+    download_part_size: int = Field(
+        8388608,
+        description="""Size in bytes of the byte-ranges fetched in parallel when
+        downloading large objects from the cache into files.""",
+    )
+
+    download_parallel: int = Field(
+        4,
+        description="""Number of threads fetching the byte-ranges of
+        large objects in parallel. Disabled if set to 1.""",
+    )
+
+    result_cache_ttl: int = Field(
+        604800,
+        description="""Time in seconds for which the results of tasks are reused
+        for identical input graphs. The result cache is disabled if set to 0.""",
+    )
+
+    journal_ttl: int = Field(
+        604800,
+        description="""Time in seconds for which the results of finished
+        workflow steps are kept for resuming a failed workflow.""",
+    )
+
+    worker_registry_ttl: float = Field(
+        60.0,
+        description="""Time in seconds after which the cached registry of tasks on
+        the remote workers is refreshed and workers without heartbeat are dropped.""",
+    )
+
+    default_priority: int = Field(
+        5,
+        ge=0,
+        le=9,
+        description="""Priority of transformations submitted without priority,
+        from 0 (lowest) to 9 (highest).""",
+    )
+
+    fair_share: bool = Field(
+        False,
+        description="""Whether the priority of a submitted transformation is lowered
+        by the rank of its owner among the owners with transformations which are not
+        ready yet, such that the backlog of one owner does not delay the others.
+        Requires authentication with tokens identifying their owner by a subject,
+        since all submissions are owned by `anonymous` otherwise.""",
+    )
+
+    inflight_ttl: int = Field(
+        86400,
+        description="""Time in seconds after which a submitted transformation is
+        no longer counted for its owner, e.g. if its result expired.""",
+    )
+
+    queue_max_depth: int = Field(
+        0,
+        description="""Number of tasks waiting in the queue of the head worker or of
+        any worker in the worker mapping beyond which new transformations are
+        rejected until the queue drained. Unlimited if set to 0.""",
+    )
+
+    owner_max_inflight: int = Field(
+        0,
+        description="""Number of transformations of an owner which are not ready
+        yet beyond which further submissions of the owner are rejected.
+        Unlimited if set to 0.""",
+    )
+
+    admission_retry_after: int = Field(
+        30,
+        description="""Time in seconds after which clients are asked to submit
+        rejected transformations again.""",
+    )
+
+    cache_ttl: int = Field(
+        604800,
+        description="""Time in seconds after which objects not accessed anymore are
+        evicted from the cache, along with the logs of finished transformations.
+        Objects of transformations which are not ready are kept. Disabled if 0.""",
+    )
+
+    cache_max_bytes: int = Field(
+        0,
+        description="""Maximum size in bytes of the objects in the cache, beyond which
+        the least recently used objects are evicted. Unlimited if set to 0.""",
+    )
+
+    cache_sweep_interval: float = Field(
+        3600.0,
+        description="""Interval in seconds for sweeping the cache by the beat of the
+        head worker. Disabled if set to 0.""",
+    )
+
+    local_cache_dir: Optional[str] = Field(
+        None,
+        description="""Directory of the on-disk cache of downloaded graphs shared by
+        the worker processes of a host. Defaults to a directory in the tempdir.""",
+    )
+
+    local_cache_max_bytes: int = Field(
+        1073741824,
+        description="""Maximum size in bytes of the on-disk cache of downloaded
+        graphs on each host. Disabled if set to 0.""",
+    )
+
+    tempfile_max_age: float = Field(
+        86400.0,
+        description="""Age in seconds after which temporary files of downloads
+        are removed by starting worker processes, unless still in use.""",
+    )
+
+    events_keepalive: float = Field(
+        15.0,
+        description="""Time in seconds after which a comment is sent through
+        idle event streams to keep the connection open.""",
+    )
+
+    log_flush_interval: float = Field(
+        2.0,
+        description="""Maximum time in seconds for which logging records of a task
+        are buffered before they are shipped to MinIO.""",
+    )
+
+    log_flush_size: int = Field(
+        65536,
+        description="""Size in bytes of buffered logging records of a task
+        which triggers an immediate shipping to MinIO.""",
+    )
+
     class Config:
         """Pydantic config for FastAPI-celery settings"""
 
         env_prefix = "REAXPRO_"
+        allow_mutation = False
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> AppConfig:
+    """Return the settings of the process, parsed once from the environment."""
+    return AppConfig()
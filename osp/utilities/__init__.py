@@ -1,6 +1,7 @@
 """OSP-utilities"""
 
 from .boto3 import get_boto3
+from .clients import clients
 from .load import get_download, get_upload
 from .minio import get_minio
 
@@ -9,4 +10,5 @@ __all__ = [
     "get_upload",
     "get_boto3",
     "get_minio",
+    "clients",
 ]
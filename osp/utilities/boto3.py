@@ -1,16 +1,33 @@
 """osp-utilities for boto3"""
+from typing import Callable, Tuple
+
 import boto3
 from botocore.client import BaseClient
+from botocore.config import Config
 
-from osp.settings import AppConfig
+from osp.settings import get_settings
 
+from .clients import clients
 
-def get_boto3() -> BaseClient:
-    """Helper function for returning S3-client using MinIO."""
-    settings = AppConfig()
-    return boto3.client(
+
+def _make_boto3() -> "Tuple[BaseClient, Callable[[], None]]":
+    """Instantiate S3-client with a connection pool due to the settings."""
+    settings = get_settings()
+    client = boto3.client(
         "s3",
         endpoint_url=f"http://{settings.minio_endpoint}",
         aws_access_key_id=settings.minio_user.get_secret_value(),
         aws_secret_access_key=settings.minio_password.get_secret_value(),
+        config=Config(
+            max_pool_connections=settings.minio_pool_size,
+            connect_timeout=settings.minio_connect_timeout,
+            read_timeout=settings.minio_read_timeout,
+            retries={"max_attempts": settings.minio_retries, "mode": "standard"},
+        ),
     )
+    return client, client.close
+
+
+def get_boto3() -> BaseClient:
+    """Helper function for returning S3-client using MinIO."""
+    return clients.get("boto3", _make_boto3)
@@ -0,0 +1,51 @@
+"""Process-wide registry of the clients to the object store"""
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+ClientFactory = Callable[[], Tuple[Any, Optional[Callable[[], None]]]]
+
+
+class ClientRegistry:
+    """Registry of lazily instantiated clients shared within one process.
+
+    The clients keep pools of open connections, which are reused by all
+    threads of the process. Since sockets must not be shared between
+    processes, the registry forgets about the clients of the parent in
+    the child after a fork, e.g. in the prefork-pool of celery workers."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._clients: "Dict[str, Tuple[Any, Optional[Callable[[], None]]]]" = {}
+        self._pid = os.getpid()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def get(self, name: str, factory: ClientFactory) -> Any:
+        """Return the client with the name or make it through the factory."""
+        if self._pid != os.getpid():
+            self._reset()
+        entry = self._clients.get(name)
+        if entry is None:
+            with self._lock:
+                entry = self._clients.get(name)
+                if entry is None:
+                    entry = self._clients[name] = factory()
+        return entry[0]
+
+    def clear(self) -> None:
+        """Close the connection pools of all clients and remove them."""
+        with self._lock:
+            entries, self._clients = self._clients, {}
+        for _, close in entries.values():
+            if close:
+                close()
+
+    def _reset(self) -> None:
+        """Drop the clients inherited from the parent without closing them."""
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pid = os.getpid()
+
+
+clients = ClientRegistry()
@@ -0,0 +1,114 @@
+"""Transparent compression of the objects in the cache"""
+import zlib
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# codecs in order of preference, named as the content-codings of HTTP
+CODECS = ("zstd", "gzip")
+
+# suffixes of files which are compressed already, e.g. tarballs of the wrappers
+COMPRESSED_SUFFIXES = (".gz", ".tgz", ".bz2", ".xz", ".zst", ".zip", ".7z")
+
+
+def get_codec(name: Optional[str]) -> Optional[str]:
+    """Return the codec available for the configured name.
+
+    Falls back to `gzip` if `zstandard` is not installed."""
+    if not name:
+        return None
+    if name not in CODECS:
+        raise ValueError(f"Unknown compression codec `{name}`, expected {CODECS}.")
+    if name == "zstd" and zstandard is None:
+        return "gzip"
+    return name
+
+
+def is_compressed(filename: str) -> bool:
+    """Return whether a file is compressed already due to its suffix,
+    in which case compressing it again would only cost time."""
+    return filename.lower().endswith(COMPRESSED_SUFFIXES)
+
+
+def _compressor(codec: str, level: Optional[int] = None):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level or 3).compressobj()
+    # wbits of 31 writes the gzip-container
+    return zlib.compressobj(level or 6, zlib.DEFLATED, 31)
+
+
+def _decompressor(codec: str):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError(
+                "Install `zstandard` for reading zstd-compressed objects."
+            )
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+class CompressingReader:
+    """File-like wrapper compressing a stream while it is read."""
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        codec: str,
+        level: Optional[int] = None,
+        chunk_size: int = 1048576,
+    ):
+        self._stream = stream
+        self._compressor = _compressor(codec, level)
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._eof = False
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Return up to `size` bytes of the compressed stream."""
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self._stream.read(self._chunk_size)
+            if data:
+                self._buffer += self._compressor.compress(data)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.size += len(data)
+        return data
+
+
+def decompress(chunks: Iterable[bytes], codec: str) -> Iterator[bytes]:
+    """Decompress a stream of chunks."""
+    decompressor = _decompressor(codec)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush() if hasattr(decompressor, "flush") else b""
+    if tail:
+        yield tail
+
+
+def accepted_codec(accept_encoding: Optional[str], codec: str) -> bool:
+    """Return whether the codec is acceptable due to an `Accept-Encoding`-header."""
+    if not accept_encoding:
+        return False
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() not in (codec, "*"):
+            continue
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
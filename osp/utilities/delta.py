@@ -0,0 +1,54 @@
+"""Exchange of graphs as differences to the graphs they were derived from"""
+from typing import TYPE_CHECKING
+
+from rdflib import BNode, ConjunctiveGraph, Graph, URIRef
+from rdflib.util import guess_format
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Optional
+
+# named graph of the removed triples in a delta, added triples are in the default graph
+REMOVED = URIRef("urn:reaxpro:delta:removed")
+DELTA_SUFFIX = ".nq"
+
+
+def _parse(path: str) -> Graph:
+    graph = Graph()
+    graph.parse(path, format=guess_format(path) or "turtle")
+    return graph
+
+
+def make_delta(base_path: str, path: str, delta_path: str) -> bool:
+    """Write the triples added and removed in the graph at `path` with respect
+    to the graph at `base_path` as N-Quads into `delta_path`.
+
+    Return False without writing if the graphs contain blank nodes, since
+    these are relabeled on every parse and cannot be compared."""
+    base, graph = _parse(base_path), _parse(path)
+    for triples in (base, graph):
+        if any(isinstance(term, BNode) for triple in triples for term in triple):
+            return False
+    delta = ConjunctiveGraph()
+    removed = delta.get_context(REMOVED)
+    for triple in graph - base:
+        delta.add(triple)
+    for triple in base - graph:
+        removed.add(triple)
+    delta.serialize(destination=delta_path, format="nquads")
+    return True
+
+
+def apply_delta(
+    base_path: str, delta_path: str, path: str, format: "Optional[str]" = None
+) -> None:
+    """Reconstruct the graph from its base and the delta into `path`."""
+    # pylint: disable=redefined-builtin
+    graph = _parse(base_path)
+    delta = ConjunctiveGraph()
+    delta.parse(delta_path, format="nquads")
+    for subject, predicate, obj, context in delta.quads((None, None, None, None)):
+        if context.identifier == REMOVED:
+            graph.remove((subject, predicate, obj))
+        else:
+            graph.add((subject, predicate, obj))
+    graph.serialize(destination=path, format=format or guess_format(path) or "turtle")
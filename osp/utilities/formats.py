@@ -0,0 +1,17 @@
+"""Formats of the graphs exchanged between the workers through the cache"""
+from enum import Enum
+
+
+class GraphFormat(str, Enum):
+    """RDF-serialization of the graphs exported by the workers.
+
+    N-Triples is line-based without prefixes or nesting, hence
+    considerably faster to serialize and to parse than Turtle."""
+
+    TURTLE = "turtle"
+    NTRIPLES = "nt"
+
+    @property
+    def suffix(self) -> str:
+        """Return the file suffix, from which the format is guessed on import."""
+        return {GraphFormat.TURTLE: ".ttl", GraphFormat.NTRIPLES: ".nt"}[self]
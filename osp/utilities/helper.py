@@ -1,46 +1,195 @@
 """Helper functions for OSP-utilities."""
-import io
+import hashlib
 import os
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Mapping, Optional, Tuple
 from uuid import uuid4
 
 from minio import Minio
+from minio.datatypes import Object
+from minio.error import S3Error
 from urllib3.response import HTTPResponse
 
+from osp.settings import get_settings
+
+from .compression import CompressingReader, get_codec, is_compressed
 from .exceptions import MinioConnectionError, MinioDownloadError
+from .layout import MISSING_CODES, get_layout
+from .lifecycle import touch_object, track_object
+
 
+def progress_channel(task_id: str) -> str:
+    """Return the Redis-channel publishing the progress of the workflow steps."""
+    return f"reaxpro:progress:{task_id}"
 
-def _get_upload(filepath: str, uuid: str, minio_client: Minio) -> str:
-    """Helper function for `depends_upload` and `get_upload`."""
-    suffix = os.path.splitext(filepath)[-1]
+
+def _get_upload(
+    filepath: str,
+    uuid: str,
+    minio_client: Minio,
+    metadata: "Optional[Dict[str, str]]" = None,
+) -> "Tuple[str, Optional[str]]":
+    """Helper function for `get_upload`, returning the key and the ETag."""
+    metadata = {"suffix": os.path.splitext(filepath)[-1], **(metadata or {})}
     # Generate a unique UUID as the object key
     object_key = uuid or str(uuid4())
 
     # Upload the file to MinIO
+    settings = get_settings()
+    codec = None if is_compressed(filepath) else get_codec(settings.cache_compression)
+    layout = get_layout()
     try:
-        if not minio_client.bucket_exists(object_key):
-            minio_client.make_bucket(object_key)
-        minio_client.fput_object(
-            object_key,
-            object_key,
-            filepath,
-            metadata={"suffix": suffix},
-        )
+        bucket = layout.prepare(object_key, minio_client)
+        if codec:
+            with open(filepath, "rb") as file:
+                reader = CompressingReader(
+                    file, codec, settings.cache_compression_level
+                )
+                result = minio_client.put_object(
+                    bucket,
+                    layout.locate(object_key)[1],
+                    reader,
+                    length=-1,
+                    part_size=settings.upload_part_size,
+                    metadata={**metadata, "codec": codec},
+                    num_parallel_uploads=settings.upload_parallel,
+                )
+            size = reader.size
+        else:
+            result = minio_client.fput_object(
+                bucket,
+                layout.locate(object_key)[1],
+                filepath,
+                metadata=metadata,
+                part_size=settings.upload_part_size,
+                num_parallel_uploads=settings.upload_parallel,
+            )
+            size = os.path.getsize(filepath)
     except Exception as err:
         raise MinioConnectionError(err.args) from err
-    return object_key
+    track_object(object_key, size, base=metadata.get("base"))
+    return object_key, result.etag
+
+
+class _HashingReader:
+    """File-like wrapper computing the content-hash of a stream while it is read."""
+
+    def __init__(self, stream: BinaryIO, algorithm: Optional[str] = None):
+        self._stream = stream
+        self._hash = hashlib.new(algorithm) if algorithm else None
+        self.size = 0
 
+    def read(self, size: int = -1) -> bytes:
+        """Read from the wrapped stream and update the hash."""
+        data = self._stream.read(size)
+        self.size += len(data)
+        if self._hash:
+            self._hash.update(data)
+        return data
 
-def _get_download(uuid: str, minio_client: Minio) -> HTTPResponse:
-    """Helper function for `depends_download` and `get_download`."""
-    file_data = io.BytesIO()
-    if not minio_client.bucket_exists(uuid):
-        raise MinioDownloadError("Bucket does not exist.")
+    @property
+    def hexdigest(self) -> Optional[str]:
+        """Return the hash of the content read so far."""
+        return self._hash.hexdigest() if self._hash else None
+
+
+def _put_stream(
+    stream: BinaryIO, suffix: str, uuid: str, minio_client: Minio
+) -> "Tuple[str, Optional[str]]":
+    """Helper function for `depends_upload`.
+
+    The stream is uploaded via multipart-upload, such that at most
+    `upload_part_size` bytes are held in memory at once. Return the key
+    and the hash of the content due to `upload_hash_algorithm`."""
+    object_key = uuid or str(uuid4())
+    settings = get_settings()
+    codec = None if is_compressed(suffix) else get_codec(settings.cache_compression)
+    reader = _HashingReader(stream, settings.upload_hash_algorithm)
+    body = reader
+    metadata = {"suffix": suffix}
+    if codec:
+        # the hash is computed for the uncompressed content
+        body = CompressingReader(reader, codec, settings.cache_compression_level)
+        metadata["codec"] = codec
+    layout = get_layout()
     try:
-        response = minio_client.get_object(
-            uuid,
-            uuid,
-            file_data,
+        bucket = layout.prepare(object_key, minio_client)
+        minio_client.put_object(
+            bucket,
+            layout.locate(object_key)[1],
+            body,
+            length=-1,
+            part_size=settings.upload_part_size,
+            metadata=metadata,
+            num_parallel_uploads=settings.upload_parallel,
         )
     except Exception as err:
-        raise MinioConnectionError(err) from err
+        raise MinioConnectionError(err.args) from err
+    track_object(object_key, body.size)
+    return object_key, reader.hexdigest
+
+
+def _get_download(
+    uuid: str,
+    minio_client: Minio,
+    offset: int = 0,
+    length: int = 0,
+    etag: Optional[str] = None,
+) -> HTTPResponse:
+    """Helper function for `depends_download` and `get_download`.
+
+    The returned response is not preloaded, hence the caller needs to
+    close it and release the connection after reading. If an `etag` is
+    given, the request fails if the object has changed in the meantime."""
+    headers = {"If-Match": f'"{etag}"'} if etag else None
+    response = _locate(
+        uuid,
+        lambda bucket, key: minio_client.get_object(
+            bucket, key, offset=offset, length=length, request_headers=headers
+        ),
+    )
+    touch_object(uuid)
     return response
+
+
+def _get_stat(uuid: str, minio_client: Minio) -> Object:
+    """Helper function for fetching the metadata of an object in the cache."""
+    return _locate(uuid, minio_client.stat_object)
+
+
+def _locate(uuid: str, request: "Callable[[str, str], Any]") -> "Any":
+    """Send a request for an object in the cache due to its layout.
+
+    Objects missing in the configured layout are looked up in the legacy
+    layout with one bucket per object, if the fallback is enabled."""
+    layout = get_layout()
+    locations = [layout.locate(uuid)]
+    if layout.fallback:
+        locations.append((uuid, uuid))
+    for bucket, key in locations:
+        try:
+            return request(bucket, key)
+        except S3Error as err:
+            if err.code not in MISSING_CODES:
+                raise MinioConnectionError(err) from err
+        except Exception as err:
+            raise MinioConnectionError(err) from err
+    raise MinioDownloadError("Object does not exist.")
+
+
+def _get_codec(headers: "Mapping[str, str]") -> Optional[str]:
+    """Return the codec of a compressed object due to its metadata."""
+    return headers.get("x-amz-meta-codec") or None
+
+
+def _get_base(headers: "Mapping[str, str]") -> Optional[str]:
+    """Return the key of the base of an object stored as delta due to its metadata."""
+    return headers.get("x-amz-meta-base") or None
+
+
+def _iter_download(response: HTTPResponse, chunk_size: int) -> Iterator[bytes]:
+    """Stream the content of a response and release the connection afterwards."""
+    try:
+        yield from response.stream(chunk_size)
+    finally:
+        response.close()
+        response.release_conn()
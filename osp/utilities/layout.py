@@ -0,0 +1,88 @@
+"""Layout of the cached objects and logs in MinIO"""
+import threading
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from minio import Minio
+from minio.error import S3Error
+
+from osp.settings import get_settings
+
+# error codes of MinIO for missing buckets and objects
+MISSING_CODES = ("NoSuchBucket", "NoSuchKey", "NoSuchObject")
+
+
+class CacheLayout:
+    """Location of the cached objects and the logs of the tasks in MinIO.
+
+    If a `bucket` is given, everything is stored in this single bucket below
+    prefixes sharded by the leading characters of the uuid, e.g. the object
+    `abcd...` as `cache/ab/cd/abcd...` and its logs below `logs/ab/cd/abcd.../`.
+    Otherwise, the legacy layout with one bucket per uuid is used."""
+
+    def __init__(
+        self, bucket: Optional[str] = None, depth: int = 2, legacy: bool = True
+    ):
+        """Initialize the layout with the bucket and the number of shard-levels."""
+        self.bucket = bucket
+        self.depth = depth
+        self.legacy = legacy
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def fallback(self) -> bool:
+        """Whether objects missing in the bucket are looked up in the legacy layout."""
+        return bool(self.bucket) and self.legacy
+
+    def locate(self, uuid: str) -> Tuple[str, str]:
+        """Return the bucket and the key of a cached object."""
+        if not self.bucket:
+            return uuid, uuid
+        return self.bucket, f"cache/{self._shard(uuid)}{uuid}"
+
+    def locate_logs(self, task_id: str) -> Tuple[str, str]:
+        """Return the bucket and the prefix of the logging chunks of a task."""
+        if not self.bucket:
+            return task_id, f"{task_id}/"
+        return self.bucket, f"logs/{self._shard(task_id)}{task_id}/"
+
+    def prepare(self, name: str, minio_client: Minio) -> str:
+        """Return the bucket for writing the object or logs with the given name.
+
+        The single bucket is created at most once per process, whereas the
+        legacy layout needs to check the bucket of every object."""
+        bucket = self.bucket or name
+        if self._ready and self.bucket:
+            return bucket
+        with self._lock:
+            if not minio_client.bucket_exists(bucket):
+                try:
+                    minio_client.make_bucket(bucket)
+                except S3Error as err:
+                    # created concurrently by another process
+                    if err.code not in (
+                        "BucketAlreadyOwnedByYou",
+                        "BucketAlreadyExists",
+                    ):
+                        raise
+            self._ready = bool(self.bucket)
+        return bucket
+
+    def _shard(self, name: str) -> str:
+        """Return the prefix of the shard including its trailing slash, if any."""
+        compact = name.replace("-", "")
+        return "".join(
+            f"{compact[2 * level : 2 * level + 2]}/" for level in range(self.depth)
+        )
+
+
+@lru_cache(maxsize=None)
+def get_layout() -> CacheLayout:
+    """Return the layout of the cache due to the settings."""
+    settings = get_settings()
+    return CacheLayout(
+        bucket=settings.cache_bucket,
+        depth=settings.cache_shard_depth,
+        legacy=settings.cache_legacy_fallback,
+    )
@@ -0,0 +1,241 @@
+"""Lifecycle and garbage collection of the objects in the cache"""
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Tuple
+
+from celery import states
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+from redis import Redis
+
+from osp.settings import get_settings
+
+from .clients import clients
+from .layout import MISSING_CODES, get_layout
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Dict, List, Optional, Set
+
+    from minio import Minio
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+ACCESS_KEY = "reaxpro:cache:access"
+SIZES_KEY = "reaxpro:cache:sizes"
+BASES_KEY = "reaxpro:cache:bases"
+TRANSFORMATIONS_KEY = "reaxpro:cache:transformations"
+REFERENCES_PREFIX = "reaxpro:cache:refs:"
+PINS_KEY = "reaxpro:cache:pins"
+LOG_SEQUENCE_PREFIX = "reaxpro:logs:sequence:"
+
+
+def _make_redis() -> "Tuple[Redis, Callable[[], None]]":
+    """Instantiate synchronous Redis-client due to the settings."""
+    client = Redis.from_url(get_settings().get_redis_address())
+    return client, client.close
+
+
+def get_redis() -> Redis:
+    """Return the synchronous Redis-client shared within the process."""
+    return clients.get("redis", _make_redis)
+
+
+def track_object(key: str, size: int = 0, base: "Optional[str]" = None) -> None:
+    """Record the upload of an object into the cache and the base of a delta."""
+    try:
+        pipeline = get_redis().pipeline()
+        pipeline.zadd(ACCESS_KEY, {key: time.time()})
+        pipeline.hset(SIZES_KEY, key, size)
+        if base:
+            pipeline.hset(BASES_KEY, key, base)
+        pipeline.execute()
+    except Exception as error:  # pylint: disable=broad-except
+        logger.warning("Could not track object %s in the cache: %s", key, error)
+
+
+def touch_object(key: str) -> None:
+    """Record the access of an object in the cache, which is only tracked
+    if it was uploaded through the tracking."""
+    try:
+        get_redis().zadd(ACCESS_KEY, {key: time.time()}, xx=True)
+    except Exception as error:  # pylint: disable=broad-except
+        logger.warning("Could not track access of object %s: %s", key, error)
+
+
+def reference_objects(task_id: str, *keys: str) -> None:
+    """Record that the objects belong to a transformation, which protects them
+    from eviction as long as the transformation is not ready."""
+    keys = [key for key in keys if key]
+    if not keys:
+        return
+    try:
+        pipeline = get_redis().pipeline()
+        pipeline.sadd(REFERENCES_PREFIX + task_id, *keys)
+        pipeline.zadd(TRANSFORMATIONS_KEY, {task_id: time.time()})
+        pipeline.execute()
+    except Exception as error:  # pylint: disable=broad-except
+        logger.warning("Could not reference objects of %s: %s", task_id, error)
+
+
+def pin_objects(ttl: int, *keys: str) -> None:
+    """Protect the objects from eviction for `ttl` seconds, e.g. as long as
+    they are referenced by a cached result."""
+    if not keys:
+        return
+    try:
+        get_redis().zadd(PINS_KEY, {key: time.time() + ttl for key in keys})
+    except Exception as error:  # pylint: disable=broad-except
+        logger.warning("Could not pin objects %s: %s", keys, error)
+
+
+def next_log_sequence(task_id: str, ttl: int = 0) -> int:
+    """Return the next number of the logging chunks of a task, which is
+    monotonic across all processes writing into the logs of the task."""
+    pipeline = get_redis().pipeline()
+    pipeline.incr(LOG_SEQUENCE_PREFIX + task_id)
+    if ttl:
+        pipeline.expire(LOG_SEQUENCE_PREFIX + task_id, ttl)
+    return pipeline.execute()[0]
+
+
+class CacheSweeper:
+    """Garbage collector for the objects and logs in the cache.
+
+    Objects are evicted if they were not accessed for `ttl` seconds or, if
+    the cache exceeds `max_bytes`, in least-recently-used order. Objects
+    referenced by transformations which are not ready yet are never evicted,
+    nor are pinned objects or the bases of deltas still in the cache.
+    Transformations not referencing any new object for `ttl` seconds are
+    released along with their logs once they are ready or unknown. A `ttl`
+    of 0 disables the expiry."""
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        minio_client: "Minio",
+        get_states: "Callable[[List[str]], List[str]]",
+        ttl: int,
+        max_bytes: int = 0,
+    ) -> None:
+        self._redis = redis_client
+        self._minio = minio_client
+        self._get_states = get_states
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+
+    def sweep(self) -> "Dict[str, int]":
+        """Release expired transformations and evict objects due to the policies."""
+        now = time.time()
+        transformations = [
+            (task_id.decode(), referenced)
+            for task_id, referenced in self._redis.zrange(
+                TRANSFORMATIONS_KEY, 0, -1, withscores=True
+            )
+        ]
+        task_states = self._get_states([task_id for task_id, _ in transformations])
+        self._redis.zremrangebyscore(PINS_KEY, "-inf", now)
+        pinned: "Set[str]" = {
+            key.decode() for key in self._redis.zrange(PINS_KEY, 0, -1)
+        }
+        released = 0
+        for (task_id, referenced), state in zip(transformations, task_states):
+            # pending tasks are unknown to the backend after their results
+            # expired, hence released as well after the time-to-live
+            if (
+                self._ttl
+                and now - referenced > self._ttl
+                and (state in states.READY_STATES or state == states.PENDING)
+            ):
+                self._release(task_id)
+                released += 1
+            elif state not in states.READY_STATES:
+                pinned.update(
+                    key.decode()
+                    for key in self._redis.smembers(REFERENCES_PREFIX + task_id)
+                )
+        evicted = self._evict(now, pinned)
+        logger.info(
+            "Released %s transformations and evicted %s objects from the cache.",
+            released,
+            evicted,
+        )
+        return {"released": released, "evicted": evicted}
+
+    def _release(self, task_id: str) -> None:
+        self._remove_logs(task_id)
+        pipeline = self._redis.pipeline()
+        pipeline.delete(REFERENCES_PREFIX + task_id, LOG_SEQUENCE_PREFIX + task_id)
+        pipeline.zrem(TRANSFORMATIONS_KEY, task_id)
+        pipeline.execute()
+
+    def _evict(self, now: float, pinned: "Set[str]") -> int:
+        candidates = [
+            (key.decode(), accessed)
+            for key, accessed in self._redis.zrange(ACCESS_KEY, 0, -1, withscores=True)
+        ]
+        sizes = {
+            key.decode(): int(size)
+            for key, size in self._redis.hgetall(SIZES_KEY).items()
+        }
+        bases = {base.decode() for base in self._redis.hvals(BASES_KEY)}
+        total = sum(sizes.get(key, 0) for key, _ in candidates)
+        evicted = 0
+        # least recently used first
+        for key, accessed in candidates:
+            expired = self._ttl and now - accessed > self._ttl
+            exceeded = self._max_bytes and total > self._max_bytes
+            if key in pinned or key in bases or not (expired or exceeded):
+                continue
+            self._remove_object(key)
+            pipeline = self._redis.pipeline()
+            pipeline.zrem(ACCESS_KEY, key)
+            pipeline.hdel(SIZES_KEY, key)
+            pipeline.hdel(BASES_KEY, key)
+            pipeline.execute()
+            total -= sizes.get(key, 0)
+            evicted += 1
+        return evicted
+
+    def _remove_object(self, key: str) -> None:
+        layout = get_layout()
+        locations = [layout.locate(key)]
+        if layout.fallback:
+            locations.append((key, key))
+        for bucket, name in locations:
+            try:
+                self._minio.remove_object(bucket, name)
+            except S3Error as error:
+                if error.code not in MISSING_CODES:
+                    raise
+            if bucket == key:
+                self._remove_bucket(bucket)
+
+    def _remove_logs(self, task_id: str) -> None:
+        layout = get_layout()
+        # the bucket of the legacy layout also holds the logs as single object
+        locations = [layout.locate_logs(task_id)] if layout.bucket else []
+        if layout.fallback or not layout.bucket:
+            locations.append((task_id, None))
+        for bucket, prefix in locations:
+            try:
+                objects = [
+                    DeleteObject(item.object_name)
+                    for item in self._minio.list_objects(
+                        bucket, prefix=prefix, recursive=True
+                    )
+                ]
+                for error in self._minio.remove_objects(bucket, objects):
+                    logger.warning("Could not remove logs of %s: %s", task_id, error)
+            except S3Error as error:
+                if error.code not in MISSING_CODES:
+                    raise
+            if bucket == task_id:
+                self._remove_bucket(bucket)
+
+    def _remove_bucket(self, bucket: str) -> None:
+        try:
+            self._minio.remove_bucket(bucket)
+        except S3Error as error:
+            if error.code not in ("NoSuchBucket", "BucketNotEmpty"):
+                raise
@@ -1,30 +1,500 @@
 """osp-utilities for up/downloads with minio"""
+import glob
+import hashlib
+import io
+import logging
+import os
+import shutil
 import tempfile
-from typing import TextIO, Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache, partial
+from typing import Callable, Iterator, Mapping, Optional, TextIO, Union
 
+from minio.datatypes import Object
 from urllib3.response import HTTPResponse
 
-from .helper import _get_download, _get_upload
+from osp.settings import get_settings
+
+from .compression import decompress
+from .delta import DELTA_SUFFIX, apply_delta, make_delta
+from .helper import (
+    _get_base,
+    _get_codec,
+    _get_download,
+    _get_stat,
+    _get_upload,
+    _iter_download,
+)
+from .lifecycle import touch_object
 from .minio import get_minio
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# directory of the temporary files of downloads, shared by the workers of a host
+TEMP_DIR = os.path.join(tempfile.gettempdir(), "reaxpro")
+
+
+class LocalCache:
+    """Size-bounded on-disk cache of objects shared by the processes of a host.
+
+    Entries are keyed by the object key and its ETag, such that objects
+    updated in place are fetched again. Each entry has a lock file, which
+    readers hold shared while using the entry and the eviction of the least
+    recently used entries holds exclusively. Missing entries are downloaded
+    under a separate lock, such that readers of an entry never wait for
+    each other but only for a concurrent download of the same entry."""
+
+    LOCK = ".lock"
+    DOWNLOAD = ".download"
+    PARTIAL = ".partial"
+
+    def __init__(self, directory: str, max_bytes: int):
+        """Initialize the cache in the directory with the maximum size."""
+        self._directory = directory
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def open(self, key: str) -> Iterator[str]:
+        """Yield the path of the cached object, downloading it if necessary."""
+        stat = _get_stat(key, get_minio())
+        suffix = stat.metadata.get("x-amz-meta-suffix") or ""
+        path = self._path(key, stat.etag, suffix)
+        try:
+            with self._locked(path + self.LOCK, fcntl.LOCK_SH):
+                if os.path.exists(path):
+                    # the access time is the order of the eviction
+                    os.utime(path)
+                    touch_object(key)
+                else:
+                    with ExitStack() as stack:
+                        # the base of a delta is resolved before locking its
+                        # download, such that no download lock is held meanwhile
+                        base = _get_base(stat.metadata)
+                        base_path = (
+                            stack.enter_context(downloaded(base)) if base else None
+                        )
+                        download = partial(
+                            _download_file, key, stat=stat, base_path=base_path
+                        )
+                        self._write(path, download)
+                yield path
+        finally:
+            # evicted also if the reader exits early, e.g. on an error
+            self._evict()
+
+    def add(self, key: str, etag: Optional[str], filepath: str) -> None:
+        """Write an uploaded file through to the cache."""
+        if not etag:
+            return
+        path = self._path(key, etag, os.path.splitext(filepath)[-1])
+        with self._locked(path + self.LOCK, fcntl.LOCK_SH):
+            self._write(path, partial(_link_file, filepath))
+        self._evict()
+
+    def _write(self, path: str, write: "Callable[[str], None]") -> None:
+        """Write a missing entry through a partial file, once across processes."""
+        with self._locked(path + self.DOWNLOAD, fcntl.LOCK_EX):
+            if os.path.exists(path):
+                return
+            try:
+                write(path + self.PARTIAL)
+                os.replace(path + self.PARTIAL, path)
+            finally:
+                self._remove_partial(path)
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries not in use beyond the size,
+        as well as the lock- and partial files of entries no longer cached."""
+        with self._locked(os.path.join(self._directory, ".cache"), fcntl.LOCK_EX):
+            entries = []
+            leftovers = set()
+            with os.scandir(self._directory) as items:
+                for item in items:
+                    if item.name.startswith(".cache") or not item.is_file():
+                        continue
+                    base, extension = os.path.splitext(item.path)
+                    if self.PARTIAL in item.name:
+                        # also the compressed parts of the download
+                        leftovers.add(item.path.split(self.PARTIAL)[0])
+                        continue
+                    if extension in (self.LOCK, self.DOWNLOAD):
+                        leftovers.add(base)
+                        continue
+                    stat = item.stat()
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self._max_bytes:
+                    break
+                if self._remove(path):
+                    total -= size
+                leftovers.discard(path)
+            cached = {path for _, _, path in entries}
+            for path in leftovers - cached:
+                self._remove(path)
+
+    def _remove(self, path: str) -> bool:
+        """Remove an entry and its files unless it is in use or downloaded."""
+        try:
+            with self._locked(path + self.LOCK, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                with self._locked(path + self.DOWNLOAD, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    self._remove_partial(path)
+                    for name in (path, path + self.DOWNLOAD):
+                        if os.path.exists(name):
+                            os.remove(name)
+                os.remove(path + self.LOCK)
+        except BlockingIOError:
+            return False  # in use by another process
+        return True
+
+    def _remove_partial(self, path: str) -> None:
+        """Remove the partial files left by a failed download of an entry."""
+        for name in glob.glob(glob.escape(path + self.PARTIAL) + "*"):
+            os.remove(name)
+
+    @contextmanager
+    def _locked(self, lockpath: str, operation: int) -> Iterator[int]:
+        """Hold the lock file while in the context.
 
-def get_upload(file: Union[str, TextIO], uuid: str = None) -> str:
-    """Upload file with minio client and return upload-id without `Depends`."""
+        Lock files are removed by the eviction while locked exclusively,
+        hence the lock is taken again if its file was replaced meanwhile."""
+        while True:
+            lock = os.open(lockpath, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(lock, operation)
+                if os.fstat(lock).st_ino == os.stat(lockpath).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(lock)
+                raise
+            os.close(lock)
+        try:
+            yield lock
+        finally:
+            os.close(lock)
+
+    def _path(self, key: str, etag: str, suffix: str) -> str:
+        etag = etag.strip('"')
+        name = hashlib.sha256(f"{key}:{etag}".encode()).hexdigest()
+        return os.path.join(self._directory, name + suffix)
+
+
+def _link_file(filepath: str, path: str) -> None:
+    """Link a file to the path, or copy it across file systems."""
+    try:
+        os.link(filepath, path)
+    except OSError:
+        shutil.copyfile(filepath, path)
+
+
+@lru_cache(maxsize=None)
+def get_local_cache() -> Optional[LocalCache]:
+    """Return the on-disk cache of the host due to the settings, if enabled."""
+    settings = get_settings()
+    if not settings.local_cache_max_bytes or fcntl is None:
+        return None
+    directory = settings.local_cache_dir or os.path.join(
+        tempfile.gettempdir(), "reaxpro-cache"
+    )
+    return LocalCache(directory, settings.local_cache_max_bytes)
+
+
+def get_upload(
+    file: Union[str, TextIO], uuid: str = None, cache_local: bool = False
+) -> str:
+    """Upload file with minio client and return upload-id without `Depends`.
+
+    With `cache_local`, the file is also written through to the on-disk cache
+    of the host, e.g. for graphs read again by other workers on this host."""
     if hasattr(file, "filename"):
         file = file.filename
     elif hasattr(file, "name"):
         file = file.name
     minio_client = get_minio()
-    return _get_upload(file, uuid, minio_client)
+    object_key, etag = _get_upload(file, uuid, minio_client)
+    local_cache = get_local_cache() if cache_local else None
+    if local_cache:
+        try:
+            local_cache.add(object_key, etag, file)
+        except OSError as error:
+            logger.warning("Could not cache %s on disk: %s", object_key, error)
+    return object_key
 
 
-def get_download(uuid: str, as_file=False) -> Union[HTTPResponse, str]:
-    """Return `io.BytesIO` from uuid through minio client without `Depends`."""
+def get_upload_graph(path: str, uuid: str = None, base: Optional[str] = None) -> str:
+    """Upload an exported graph and write it through to the on-disk cache.
+
+    If the exchange of deltas is enabled and `base` gives the key of the
+    graph which the exported one was derived from, only the triples added
+    and removed are uploaded along with a reference to the base. The
+    graph is reconstructed from its bases when downloaded."""
+    if not (base and get_settings().graph_delta) or base == uuid:
+        return get_upload(path, uuid=uuid, cache_local=True)
+    delta_path = path + DELTA_SUFFIX
+    try:
+        with downloaded(base) as base_path:
+            changed = make_delta(base_path, path, delta_path)
+        if not changed:
+            return get_upload(path, uuid=uuid, cache_local=True)
+        metadata = {"suffix": os.path.splitext(path)[-1], "base": base}
+        object_key, etag = _get_upload(delta_path, uuid, get_minio(), metadata)
+    finally:
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+    local_cache = get_local_cache()
+    if local_cache:
+        try:
+            local_cache.add(object_key, etag, path)
+        except OSError as error:
+            logger.warning("Could not cache %s on disk: %s", object_key, error)
+    return object_key
+
+
+def get_download(
+    uuid: str, as_file=False
+) -> Union[HTTPResponse, "DecodedResponse", str]:
+    """Return `io.BytesIO` from uuid through minio client without `Depends`.
+
+    Compressed objects and deltas are streamed decoded through a response
+    with the same interface. Files are written into `TEMP_DIR` and need to
+    be removed by the caller, e.g. through `downloaded`."""
     minio_client = get_minio()
-    response = _get_download(uuid, minio_client)
     if as_file:
-        suffix = response.headers.get("x-amz-meta-suffix")
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp:
-            temp.write(response.data)
-            response = temp.name
+        stat = _get_stat(uuid, minio_client)
+        suffix = stat.metadata.get("x-amz-meta-suffix")
+        os.makedirs(TEMP_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            suffix=suffix, dir=TEMP_DIR, delete=False
+        ) as temp:
+            path = temp.name
+        try:
+            _download_file(uuid, path, stat)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+    response = _get_download(uuid, minio_client)
+    if _get_base(response.headers):
+        response.close()
+        response.release_conn()
+        with ExitStack() as stack:
+            path = stack.enter_context(downloaded(uuid))
+            file = stack.enter_context(open(path, "rb"))
+            chunk_size = get_settings().download_chunk_size
+            chunks = iter(lambda: file.read(chunk_size), b"")
+            # the file is kept open until the response is closed
+            return DecodedResponse(chunks, response.headers, stack.pop_all().close)
+    if _get_codec(response.headers):
+        return DecodedResponse(
+            _iter_decoded(response),
+            response.headers,
+            partial(_close_response, response),
+        )
     return response
+
+
+class DecodedResponse(io.RawIOBase):
+    """Stream of the decoded content of an object with the interface of
+    the `HTTPResponse` of the MinIO-client, e.g. for compressed objects."""
+
+    def __init__(
+        self,
+        chunks: Iterator[bytes],
+        headers: "Mapping[str, str]",
+        release: "Callable[[], None]",
+    ):
+        super().__init__()
+        self._chunks = chunks
+        self._release = release
+        self._buffer = b""
+        self.headers = {
+            name: value
+            for name, value in headers.items()
+            if name.lower()
+            not in ("content-length", "x-amz-meta-codec", "x-amz-meta-base")
+        }
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        """Read the next decoded bytes into the buffer, 0 at the end."""
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = chunk
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def stream(self, amt: int = 65536) -> Iterator[bytes]:
+        """Yield the decoded content in chunks of at most `amt` bytes."""
+        while True:
+            data = self.read(amt)
+            if not data:
+                return
+            yield data
+
+    @property
+    def data(self) -> bytes:
+        """Return the remaining decoded content at once."""
+        return self.read()
+
+    def release_conn(self) -> None:
+        """Release the connection or file of the object."""
+        self.close()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._release()
+        super().close()
+
+
+def _close_response(response: HTTPResponse) -> None:
+    response.close()
+    response.release_conn()
+
+
+def _download_file(
+    uuid: str, path: str, stat: Object, base_path: Optional[str] = None
+) -> None:
+    """Download an object into a file, reconstructing it if it is a delta.
+
+    The base of the delta is downloaded unless its path is given."""
+    base = _get_base(stat.metadata)
+    if not base:
+        _download_object(uuid, path, stat)
+        return
+    delta_path = path + DELTA_SUFFIX
+    try:
+        _download_object(uuid, delta_path, stat)
+        if base_path:
+            apply_delta(base_path, delta_path, path)
+            return
+        # the bases are reconstructed recursively through the local cache
+        with downloaded(base) as downloaded_base:
+            apply_delta(downloaded_base, delta_path, path)
+    finally:
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+
+
+def _download_object(uuid: str, path: str, stat: Object) -> None:
+    """Download an object into a file, decompressing it if necessary.
+
+    Objects larger than the part size are fetched as byte-ranges by
+    parallel threads writing straight into the file, such that they
+    are never held in memory at once."""
+    settings = get_settings()
+    minio_client = get_minio()
+    part_size = settings.download_part_size
+    if stat.size <= part_size or settings.download_parallel <= 1:
+        response = _get_download(uuid, minio_client, etag=stat.etag)
+        with open(path, "wb") as file:
+            for chunk in _iter_decoded(response):
+                file.write(chunk)
+        return
+
+    codec = _get_codec(stat.metadata)
+    target = f"{path}.{codec}" if codec else path
+    with open(target, "wb") as file:
+        file.truncate(stat.size)
+
+        def fetch(offset: int) -> None:
+            length = min(part_size, stat.size - offset)
+            response = _get_download(
+                uuid, minio_client, offset=offset, length=length, etag=stat.etag
+            )
+            for chunk in _iter_download(response, settings.download_chunk_size):
+                os.pwrite(file.fileno(), chunk, offset)
+                offset += len(chunk)
+
+        with ThreadPoolExecutor(settings.download_parallel) as pool:
+            # consume the results for raising the errors of the threads
+            list(pool.map(fetch, range(0, stat.size, part_size)))
+    if codec:
+        try:
+            with open(target, "rb") as source, open(path, "wb") as file:
+                chunks = iter(lambda: source.read(settings.download_chunk_size), b"")
+                for chunk in decompress(chunks, codec):
+                    file.write(chunk)
+        finally:
+            os.remove(target)
+
+
+def _iter_decoded(response: HTTPResponse) -> Iterator[bytes]:
+    """Stream the decompressed content of a response and release it afterwards."""
+    chunks = _iter_download(response, get_settings().download_chunk_size)
+    codec = _get_codec(response.headers)
+    return decompress(chunks, codec) if codec else chunks
+
+
+@contextmanager
+def downloaded(uuid: str) -> Iterator[str]:
+    """Yield the path of the downloaded object, which must only be read.
+
+    The object is read through the on-disk cache of the host, if enabled,
+    and otherwise downloaded into a temporary file removed afterwards."""
+    local_cache = get_local_cache()
+    if local_cache:
+        with local_cache.open(uuid) as path:
+            yield path
+        return
+    path = get_download(uuid, as_file=True)
+    try:
+        with open(path, "rb") as lock:
+            # the lock keeps the cleanup of other processes off the file
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_SH)
+            yield path
+    finally:
+        os.remove(path)
+
+
+def cleanup_tempfiles(max_age: float) -> int:
+    """Remove temporary files of downloads older than `max_age` seconds,
+    e.g. left over by crashed processes. Files still locked by the processes
+    reading them are kept. Return the number of removed files."""
+    if not os.path.isdir(TEMP_DIR):
+        return 0
+    threshold = time.time() - max_age
+    removed = 0
+    with os.scandir(TEMP_DIR) as entries:
+        for entry in entries:
+            try:
+                if (
+                    entry.is_file()
+                    and entry.stat().st_mtime < threshold
+                    and _remove_unlocked(entry.path)
+                ):
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    if removed:
+        logger.info("Removed %s stale temporary files from %s.", removed, TEMP_DIR)
+    return removed
+
+
+def _remove_unlocked(path: str) -> bool:
+    """Remove the file unless it is locked by a process reading it."""
+    with open(path, "rb") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        os.remove(path)
+    return True
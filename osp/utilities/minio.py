@@ -1,15 +1,39 @@
 """MinIO-related utilities for SimPhoNy-OSP"""
+from typing import Callable, Tuple
+
+import urllib3
 from minio import Minio
 
-from osp.settings import AppConfig
+from osp.settings import get_settings
 
+from .clients import clients
 
-def get_minio() -> Minio:
-    """Instantiate MinIO-client without `Depends`."""
-    settings = AppConfig()
-    return Minio(
+
+def _make_minio() -> "Tuple[Minio, Callable[[], None]]":
+    """Instantiate MinIO-client with a connection pool due to the settings."""
+    settings = get_settings()
+    http_client = urllib3.PoolManager(
+        maxsize=settings.minio_pool_size,
+        timeout=urllib3.Timeout(
+            connect=settings.minio_connect_timeout,
+            read=settings.minio_read_timeout,
+        ),
+        retries=urllib3.Retry(
+            total=settings.minio_retries,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504],
+        ),
+    )
+    client = Minio(
         settings.minio_endpoint,
         access_key=settings.minio_user.get_secret_value(),
         secret_key=settings.minio_password.get_secret_value(),
         secure=False,
+        http_client=http_client,
     )
+    return client, http_client.clear
+
+
+def get_minio() -> Minio:
+    """Return the MinIO-client shared within the process without `Depends`."""
+    return clients.get("minio", _make_minio)
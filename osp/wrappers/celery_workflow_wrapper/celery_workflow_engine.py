@@ -1,19 +1,32 @@
 """Module for Celery-workflow engine."""
+import json
 import logging
 import tempfile
 from typing import TYPE_CHECKING
 
 from celery import Celery, signals
-from celery.result import allow_join_result
+from celery.canvas import Signature
 
 from osp.core.namespaces import emmo, get_entity
 from osp.core.session import CoreSession
 from osp.core.utils import export_cuds, import_cuds
-from osp.settings import AppConfig
-from osp.utilities.load import get_download, get_upload
+from osp.settings import AppConfig, get_settings
+from osp.utilities.formats import GraphFormat
+from osp.utilities.helper import progress_channel
+from osp.utilities.lifecycle import reference_objects
+from osp.utilities.load import downloaded, get_upload, get_upload_graph
+
+from .journal import WorkflowJournal
+from .mapping import (
+    OntologyIndex,
+    OutputIndex,
+    parse_output_mapping,
+    parse_worker_mapping,
+)
+from .steps import WorkflowSteps, make_chord, make_levels
 
 if TYPE_CHECKING:
-    from typing import UUID, Any, Dict, List, Optional, Tuple
+    from typing import UUID, Any, Dict, Iterable, List, Optional, Tuple
 
     from osp.core.cuds import Cuds
     from osp.core.ontology import OntologyClass
@@ -42,8 +55,22 @@ def on_setup_logging(**kwargs):  # pylint: disable=unused-argument
     celery_logger.addHandler(console_handler)
 
 
+def advance_task_name(worker_name: str) -> str:
+    """Return the name of the task advancing the workflows of a head worker."""
+    return f"{worker_name}.advance"
+
+
 class CeleryWorkflowEngine:
-    """Class definition for Celery-workflow engine."""
+    """Class definition for Celery-workflow engine.
+
+    The workflow steps form a DAG through the outputs they consume from
+    each other. Steps are grouped into levels, such that all steps of one
+    level only depend on steps of previous levels. The engine does not
+    wait for the results of the workflow steps: each level is sent as a
+    task on the remote worker, or as a chord of several such tasks, chained
+    with a task on the queue of the head worker, which maps the outputs
+    and sends the next level (see `advance`). The state of the workflow
+    is passed along with these tasks."""
 
     def __init__(
         self,
@@ -54,7 +81,7 @@ class CeleryWorkflowEngine:
     ) -> None:
         """Initalize the Celery-Workflow engine."""
         if not settings:
-            settings = AppConfig()
+            settings = get_settings()
         self._settings = settings
         if not app:
             address = self._settings.get_redis_address()
@@ -63,84 +90,242 @@ class CeleryWorkflowEngine:
         self._app: Celery = app
         self._input_uuid: "UUID" = input_uuid
         self._task_id: "Optional[UUID]" = None
-        self._tasks: List = []
-        self._results: List = []
+        self._steps = WorkflowSteps()
+        self._state: "Dict[str, Any]" = {}
+
+    @classmethod
+    def from_state(
+        cls, state: "Dict[str, Any]", app: Celery = None, settings: AppConfig = None
+    ) -> "CeleryWorkflowEngine":
+        """Restore the engine from the state passed along with the workflow."""
+        engine = cls(
+            state["input_uuid"],
+            app=app,
+            settings=settings,
+            logging_id=state["logging_id"],
+        )
+        engine._state = state  # pylint: disable=protected-access
+        return engine
 
     def add_task(self, mapping: "Tuple[Cuds, str]") -> None:
         """Add the name of an existing worker and the
         calculation type to batch."""
-        self._tasks.append(mapping)
-
-    def run(self) -> str:
-        """Run the celery workflow engine"""
-        return self._create_pipeline()
-
-    # define a function to execute a task on a remote Celery worker
-    def _execute_task(self, worker_name: str, task_id: str) -> "str":
-        """Send a task to the Celery-app"""
-        task = self._app.send_task(
-            worker_name,
-            kwargs={"cache_key": task_id, "task_id": self._logging_id},
-            queue=worker_name,
+        self._steps.add(mapping)
+
+    def add_dependencies(self, index: int, depends: "Iterable[int]") -> None:
+        """Define the steps whose outputs are consumed by the step with the index.
+
+        Steps without defined dependencies depend on the previous step."""
+        self._steps.add_dependencies(index, depends)
+
+    def run(self) -> None:
+        """Prepare the state of the workflow to be sent through `dispatch`"""
+        depends = self._steps.resolve()
+        self._state = {
+            "input_uuid": str(self._input_uuid),
+            "logging_id": self._logging_id,
+            "steps": [
+                {
+                    "iri": str(calculation.iri),
+                    "oclasses": [str(oclass) for oclass in calculation.oclasses],
+                    "worker": worker_name,
+                    "depends": depends[index],
+                }
+                for index, (calculation, worker_name) in enumerate(self._steps.tasks)
+            ],
+            "levels": make_levels(depends),
+            "level": 0,
+            "results": [None] * len(self._steps.tasks),
+        }
+
+    def dispatch(
+        self,
+        cache_meta: str,
+        resume: bool = False,
+        priority: "Optional[int]" = None,
+        **options: "Any",
+    ) -> "Any":
+        """Return the signature of the first level of workflow steps.
+
+        The `cache_meta` of the head worker is returned as part of the
+        final result once the last step has finished. The `options` are
+        passed as keyword arguments to the tasks of all steps. If `resume`
+        is set, the steps which finished during a previous submission of the
+        same input are not run again but their journaled results are reused.
+        The steps are queued with the broker-`priority` of the workflow.
+        If all steps already finished, the final result is returned."""
+        state = self._state
+        state["cache_meta"] = cache_meta
+        state["options"] = options
+        state["priority"] = priority
+        journal = self.journal
+        entries = journal.load(state["steps"]) if resume else {}
+        if entries:
+            for index, entry in entries.items():
+                state["results"][index] = entry
+            logger.info("Resuming workflow with finished steps %s", sorted(entries))
+        else:
+            # no journal or one of different steps, which is started anew
+            journal.start(state["steps"])
+        return self._make_next()
+
+    def advance(self, result: "Any") -> "Any":
+        """Register the results of the finished level of workflow steps.
+
+        Returns the signature of the next level or, if the workflow is
+        complete, the final result of the workflow."""
+        state = self._state
+        indices = state["pending"]
+        # several steps of a level are joined by a chord returning a list
+        results = result if len(indices) > 1 else [result]
+        journal = self.journal
+        for index, step_result in zip(indices, results):
+            worker_name = state["steps"][index]["worker"]
+            state["results"][index] = [worker_name, step_result]
+            journal.record(index, state["results"][index])
+            self._publish_progress(index, "SUCCESS")
+            logger.info("Workflow step %s finished: %s", worker_name, step_result)
+        state["level"] += 1
+        return self._make_next()
+
+    def _make_next(self) -> "Any":
+        """Return the signature of the next level with unfinished steps
+        or the final result if all steps have finished."""
+        state = self._state
+        while state["level"] < len(state["levels"]):
+            pending = [
+                index
+                for index in state["levels"][state["level"]]
+                if not state["results"][index]
+            ]
+            if pending:
+                state["pending"] = pending
+                return self._make_level()
+            state["level"] += 1
+        return {"cache_meta": state["cache_meta"], "cache_raw": self.result}
+
+    def _make_level(self) -> Signature:
+        """Create the signature of the pending steps and the following `advance`"""
+        state = self._state
+        tasks = [self._make_step(index) for index in state["pending"]]
+        advance = self._app.signature(
+            advance_task_name(self.settings.worker_name),
+            kwargs={"state": state},
+            queue=self.settings.worker_name,
+            priority=state.get("priority"),
+        )
+        for index in state["pending"]:
+            self._publish_progress(index, "SENT")
+        return make_chord(tasks, advance)
+
+    def _publish_progress(self, index: int, status: str) -> None:
+        """Publish the progress of a workflow step to the subscribers of the task."""
+        state = self._state
+        message = {
+            "step": index,
+            "worker": state["steps"][index]["worker"],
+            "status": status,
+            "finished": sum(1 for entry in state["results"] if entry),
+            "total": len(state["steps"]),
+        }
+        self._app.backend.client.publish(
+            progress_channel(self._logging_id), json.dumps(message)
         )
-        with allow_join_result():
-            result = task.get()
-        self._results.append((worker_name, result))
-        return result["cache_meta"]
-
-    # define a function to create a chain of tasks based on the list of workers
-    def _create_pipeline(self) -> str:
-        """Create a list of tasks to execute in a chain"""
-        uuid = self._input_uuid
-        for calculation_cuds, worker_name in self._tasks:
-            uuid = self._make_output_mapping(calculation_cuds, uuid)
-            uuid = self._execute_task(worker_name, uuid)
-        return uuid
 
-    def _make_output_mapping(self, calculation: "Cuds", uuid: "UUID") -> "UUID":
-        mappings = self._scan_output_mapping(calculation)
+    def _make_step(self, index: int) -> Signature:
+        """Create the signature of the workflow step on the remote worker"""
+        step = self._state["steps"][index]
+        uuids = [
+            self._state["results"][depend][1]["cache_meta"]
+            for depend in step["depends"]
+        ] or [self._state["input_uuid"]]
+        uuid = self._make_output_mapping(step, uuids)
+        logger.info("Sending workflow step %s with input %s", step["worker"], uuid)
+        return self._app.signature(
+            step["worker"],
+            kwargs={
+                "cache_key": uuid,
+                "task_id": self._logging_id,
+                **self._state.get("options", {}),
+            },
+            queue=step["worker"],
+            priority=self._state.get("priority"),
+        )
+
+    def _make_output_mapping(
+        self, step: "Dict[str, Any]", uuids: "List[UUID]"
+    ) -> "UUID":
+        """Merge the graphs of the inputs and map the outputs onto the step."""
+        oclasses = [get_entity(oclass) for oclass in step["oclasses"]]
+        mappings = self._scan_output_mapping(oclasses)
+        if not mappings and len(uuids) == 1:
+            return uuids[0]
         if mappings:
             logger.info(
                 """Found a match for input mapping for %s
                 cue to outputs from a previous calculation: %s""",
-                calculation,
+                step["iri"],
                 mappings,
             )
-            cuds_file = get_download(uuid, as_file=True)
-            core_session = CoreSession()
-            import_cuds(cuds_file, session=core_session)
-            query = core_session.load_from_iri(str(calculation.iri))
-            current = query.first()  # pylint: disable=no-member
-            if not current:
-                raise ValueError(
-                    f"Current calculation `{calculation}` not found in graph with object-id {uuid}"
-                )
-            for mapping in mappings:
-                previous = mapping["previous"].iri
-                output = mapping["output"].iri
-                result = core_session.sparql(
-                    f"""select ?output where {{
-                        ?previous rdf:type <{previous}> .
-                        ?previous <{emmo.hasOutput.iri}> ?output .
-                        ?output rdf:type <{output}> .
-                    }}"""
-                )
-                for row in result(output="cuds"):
-                    current.add(row["output"], rel=emmo.hasInput)
-            with tempfile.NamedTemporaryFile(suffix=".ttl", delete=False) as file:
-                export_cuds(core_session, file.name)
-                uuid = get_upload(file, uuid=uuid)
+        core_session = CoreSession()
+        for uuid in uuids:
+            with downloaded(uuid) as cuds_file:
+                import_cuds(cuds_file, session=core_session)
+        if mappings:
+            self._map_outputs(core_session, step, mappings, uuids)
+        uuid = self._store_graph(core_session, uuids)
+        reference_objects(self._logging_id, uuid)
         return uuid
 
+    @staticmethod
+    def _map_outputs(
+        core_session: CoreSession,
+        step: "Dict[str, Any]",
+        mappings: "List[Dict[str, OntologyClass]]",
+        uuids: "List[UUID]",
+    ) -> None:
+        """Add the mapped outputs of previous steps as inputs of the step."""
+        query = core_session.load_from_iri(step["iri"])
+        current = query.first()  # pylint: disable=no-member
+        if not current:
+            raise ValueError(
+                f"Current calculation `{step['iri']}` not found "
+                f"in graph with object-ids {uuids}"
+            )
+        # all entries of the mapping are answered in one pass over the graph
+        index = OutputIndex(core_session.graph, emmo.hasOutput.iri)
+        outputs = [
+            cuds
+            for cuds in core_session.load_from_iri(*index.lookup(mappings))
+            if cuds is not None
+        ]
+        if outputs:
+            current.add(*outputs, rel=emmo.hasInput)
+
+    def _store_graph(self, core_session: CoreSession, uuids: "List[UUID]") -> "UUID":
+        """Upload the graph of the session as input of the step."""
+        # a single graph is updated in place, merged graphs are stored as new
+        # object, as are deltas since other deltas may refer to their base and
+        # graphs which may be cached results, which must match their digest
+        settings = get_settings()
+        in_place = len(uuids) == 1 and not settings.result_cache_ttl
+        graph_format = GraphFormat(
+            self._state.get("options", {}).get("graph_format", GraphFormat.TURTLE)
+        )
+        with tempfile.NamedTemporaryFile(suffix=graph_format.suffix) as file:
+            export_cuds(core_session, file.name, format=graph_format.value)
+            if settings.graph_delta:
+                return get_upload_graph(file.name, base=uuids[0])
+            return get_upload(
+                file, uuid=uuids[0] if in_place else None, cache_local=True
+            )
+
     def _scan_output_mapping(
-        self, calculation: "Cuds"
+        self, oclasses: "Iterable[OntologyClass]"
     ) -> "List[Dict[str, OntologyClass]]":
-        response = []
-        for superclass, mapping in self.output_mapping.items():
-            if calculation.is_a(superclass):
-                response.append(mapping)
+        response = self.output_index.lookup_oclasses(oclasses)
         if response:
-            response = response.pop()
+            response = response[-1]
         return response
 
     @property
@@ -148,42 +333,55 @@ class CeleryWorkflowEngine:
         """Return the engine settings."""
         return cls._settings
 
+    @property
+    def worker_index(cls) -> OntologyIndex:
+        """Return the index of the ontology classes and worker names"""
+        return parse_worker_mapping(cls.settings.worker_mapping)
+
+    @property
+    def output_index(cls) -> OntologyIndex:
+        """Return the index of the output mappings of the ontology classes"""
+        return parse_output_mapping(cls.settings.output_mapping)
+
     @property
     def worker_mapping(cls) -> "Dict[str, Any]":
         """Return the mappings of the ontology class and worker name"""
-        return {
-            get_entity(mapping.split(":")[0].strip()): mapping.split(":")[-1]
-            for mapping in cls.settings.worker_mapping.split("|")
-        }
+        return cls.worker_index.mapping
 
     @property
     def output_mapping(cls) -> "Dict[str, Any]":
         "Output mapping for previous calculations for next calculation"
-        mapping = {}
-        for entry in cls.settings.output_mapping.split("|"):
-            entities = [get_entity(entity.strip()) for entity in entry.split(":")]
-            key = entities[0]
-            values = [{"previous": entities[1], "output": entities[2]}]
-            if key in mapping:
-                mapping[key] += values
-            else:
-                mapping[key] = values
-        return mapping
+        return cls.output_index.mapping
 
     @property
     def result(cls) -> "Dict[str, Any]":
         """Return the final result of the workflow"""
         return {
-            f"{n}_{worker_name}": result["cache_raw"]
-            for n, (worker_name, result) in enumerate(cls.results)
+            f"{n}_{entry[0]}": entry[1]["cache_raw"]
+            for n, entry in enumerate(cls.results)
+            if entry
         }
 
     @property
     def results(cls) -> "List[Dict[str, Any]]":
         """Return the results from the celery engine."""
-        return cls._results
+        return cls._state.get("results", [])
+
+    @property
+    def journal(cls) -> WorkflowJournal:
+        """Return the journal of the finished steps of the workflow."""
+        return WorkflowJournal(
+            cls._app.backend.client,
+            cls._state["input_uuid"],
+            cls.settings.journal_ttl,
+        )
+
+    @property
+    def dependencies(cls) -> "Dict[int, List[int]]":
+        """Return the steps whose outputs are consumed by the workflow steps."""
+        return cls._steps.depends
 
     @property
     def tasks(cls) -> "List[str]":
         """Return the list of tasks to pass the knowledge graph in a chain."""
-        return cls._tasks
+        return cls._steps.tasks
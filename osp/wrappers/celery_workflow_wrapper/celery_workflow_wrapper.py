@@ -9,8 +9,9 @@ from osp.core.session import SimWrapperSession
 from .celery_workflow_engine import CeleryWorkflowEngine
 
 if TYPE_CHECKING:
-    from typing import UUID, Any, Dict, List, Optional
+    from typing import UUID, Any, Dict, List, Optional, Union
 
+    from celery.canvas import Signature
     from pydantic import BaseSettings
 
     from osp.core.cuds import Cuds
@@ -39,10 +40,16 @@ class CeleryWorkflowSession(SimWrapperSession):
         return "CeleryWorkflowSession"
 
     # OVERRIDE
-    def _run(self, root_cuds_object) -> str:
+    def _run(self, root_cuds_object) -> None:
         """Run the wrapper session."""
         return self._engine.run()
 
+    def dispatch(
+        self, cache_meta: str, resume: bool = False, **options: "Any"
+    ) -> "Union[Signature, Dict[str, Any]]":
+        """Return the signature starting the workflow on the remote workers."""
+        return self._engine.dispatch(cache_meta, resume=resume, **options)
+
     # OVERRIDE
     def _apply_added(self, root_obj, buffer) -> None:
         """Apply scans of added cuds in buffer."""
@@ -62,6 +69,31 @@ class CeleryWorkflowSession(SimWrapperSession):
             message = """Scan for workflow steps complete.
             Identified the following chain of workers: %s"""
             logger.info(message, self._engine.tasks)
+        self._scan_for_dependencies()
+
+    def _scan_for_dependencies(self) -> None:
+        """Derive the DAG of the workflow steps from the output mapping.
+
+        A step consumes the outputs of all previous steps matching one of the
+        `previous`-classes of its output mapping. Steps without any output
+        mapping, or whose mapping matches none of the previous steps, keep
+        depending on the step before them in the chain."""
+        tasks = self._engine.tasks
+        for index, (calculation, _) in enumerate(tasks):
+            mappings = self._engine.output_index.lookup(calculation)
+            if not mappings:
+                continue
+            previous = [mapping["previous"] for mapping in mappings[-1]]
+            depends = [
+                other_index
+                for other_index, (other, _) in enumerate(tasks[:index])
+                if any(other.is_a(oclass) for oclass in previous)
+            ]
+            if depends:
+                self._engine.add_dependencies(index, depends)
+        message = """Identified the following dependencies
+        between the workflow steps: %s"""
+        logger.info(message, self._engine.dependencies)
 
     def _scan_for_neighbours(self, obj: "Cuds", step: str = "first") -> None:
         """Scan the input cuds for neighbour-tasks"""
@@ -98,10 +130,7 @@ class CeleryWorkflowSession(SimWrapperSession):
             self._engine.add_task((calculation, mapping))
 
     def _scan_worker_mapping(self, calculation: "Cuds") -> "Optional[str]":
-        response = []
-        for superclass, mapping in self.worker_mapping.items():
-            if calculation.is_a(superclass):
-                response.append(mapping)
+        response = list(self._engine.worker_index.lookup(calculation))
         if len(response) > 1:
             raise ValueError(
                 f"More than 1 {calculation.oclass} found in worker mapping!"
@@ -0,0 +1,53 @@
+"""Journal of the finished steps of a workflow for resuming it later."""
+import json
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List
+
+    from redis import Redis
+
+
+class WorkflowJournal:
+    """Journal of the results of finished workflow steps stored in Redis.
+
+    The journal is kept per input of the workflow, such that a resubmission
+    of the same transformation can skip the steps which already finished.
+    It is only valid for the very same list of steps, which is recorded
+    along with the results."""
+
+    PREFIX = "reaxpro:journal:"
+
+    def __init__(self, client: "Redis", input_uuid: str, ttl: int) -> None:
+        self._client = client
+        self._key = self.PREFIX + input_uuid
+        self._ttl = ttl
+
+    def start(self, steps: "List[Dict[str, Any]]") -> None:
+        """Discard previous entries and start the journal for the steps."""
+        pipeline = self._client.pipeline()
+        pipeline.delete(self._key)
+        pipeline.hset(self._key, "steps", self._fingerprint(steps))
+        pipeline.expire(self._key, self._ttl)
+        pipeline.execute()
+
+    def load(self, steps: "List[Dict[str, Any]]") -> "Dict[int, Any]":
+        """Return the entries of the finished steps, if recorded for the same steps."""
+        entries = self._client.hgetall(self._key)
+        recorded = entries.pop(b"steps", None)
+        if recorded is None or recorded.decode() != self._fingerprint(steps):
+            return {}
+        return {int(index): json.loads(entry) for index, entry in entries.items()}
+
+    def record(self, index: int, entry: "Any") -> None:
+        """Record the entry of a finished step."""
+        pipeline = self._client.pipeline()
+        pipeline.hset(self._key, str(index), json.dumps(entry))
+        pipeline.expire(self._key, self._ttl)
+        pipeline.execute()
+
+    @staticmethod
+    def _fingerprint(steps: "List[Dict[str, Any]]") -> str:
+        return json.dumps(
+            [[step["iri"], step["worker"], step["depends"]] for step in steps]
+        )
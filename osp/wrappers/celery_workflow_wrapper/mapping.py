@@ -0,0 +1,116 @@
+"""Indices for the mappings between ontology classes and workers or outputs."""
+from collections import defaultdict
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from rdflib import RDF
+
+from osp.core.namespaces import get_entity
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, Iterable, List, Set, Tuple
+
+    from rdflib import Graph, URIRef
+
+    from osp.core.cuds import Cuds
+    from osp.core.ontology import OntologyClass
+
+
+class OntologyIndex:
+    """Index of values mapped to ontology classes.
+
+    The subclass closure of every mapped class is resolved once, such that
+    the values for an ontology class are found through a single lookup
+    instead of `is_a`-checks against every entry of the mapping. The
+    values are returned in the order of the mapping, exactly like the
+    former linear scans did."""
+
+    def __init__(self, mapping: "Dict[OntologyClass, Any]") -> None:
+        self._mapping = mapping
+        self._values: "List[Any]" = list(mapping.values())
+        self._index: "Dict[OntologyClass, Set[int]]" = {}
+        for position, oclass in enumerate(mapping):
+            for subclass in set(oclass.subclasses) | {oclass}:
+                self._index.setdefault(subclass, set()).add(position)
+        self._lookups: "Dict[Tuple[OntologyClass, ...], List[Any]]" = {}
+
+    def lookup(self, cuds: "Cuds") -> "List[Any]":
+        """Return the values of all mapped classes the cuds is a subclass of."""
+        return self.lookup_oclasses(cuds.oclasses)
+
+    def lookup_oclasses(self, oclasses: "Iterable[OntologyClass]") -> "List[Any]":
+        """Return the values of all mapped classes the oclasses are subclasses of."""
+        oclasses = tuple(oclasses)
+        values = self._lookups.get(oclasses)
+        if values is None:
+            positions = set()
+            for oclass in oclasses:
+                positions |= self._index.get(oclass, set())
+            values = [self._values[position] for position in sorted(positions)]
+            self._lookups[oclasses] = values
+        return values
+
+    @property
+    def mapping(self) -> "Dict[OntologyClass, Any]":
+        """Return the underlying mapping of ontology classes to values."""
+        return self._mapping
+
+
+class OutputIndex:
+    """Index of the outputs of the calculations in an RDF-graph.
+
+    The types and the outputs of all individuals are collected in a single
+    pass over the graph, such that the outputs for all entries of an output
+    mapping are found without querying the graph once per entry."""
+
+    def __init__(self, graph: "Graph", has_output: "URIRef") -> None:
+        self._types: "Dict[URIRef, Set[URIRef]]" = defaultdict(set)
+        self._outputs: "Dict[URIRef, List[URIRef]]" = defaultdict(list)
+        for subject, _, oclass in graph.triples((None, RDF.type, None)):
+            self._types[subject].add(oclass)
+        for subject, _, output in graph.triples((None, has_output, None)):
+            self._outputs[subject].append(output)
+
+    def lookup(self, mappings: "Iterable[Dict[str, OntologyClass]]") -> "List[URIRef]":
+        """Return the outputs of the given types of the calculations of the given
+        types for all entries of the mapping at once, without duplicates."""
+        wanted: "Dict[URIRef, Set[URIRef]]" = defaultdict(set)
+        for mapping in mappings:
+            wanted[mapping["previous"].iri].add(mapping["output"].iri)
+        found = {}
+        for subject, outputs in self._outputs.items():
+            types = set()
+            for oclass in self._types.get(subject, ()):
+                types |= wanted.get(oclass, set())
+            if not types:
+                continue
+            for output in outputs:
+                if types & self._types.get(output, set()):
+                    found.setdefault(output, None)
+        return list(found)
+
+
+@lru_cache(maxsize=None)
+def parse_worker_mapping(specification: str) -> OntologyIndex:
+    """Parse the worker mapping of the settings into an index."""
+    return OntologyIndex(
+        {
+            get_entity(mapping.split(":")[0].strip()): mapping.split(":")[-1]
+            for mapping in specification.split("|")
+        }
+    )
+
+
+@lru_cache(maxsize=None)
+def parse_output_mapping(specification: str) -> OntologyIndex:
+    """Parse the output mapping of the settings into an index."""
+    mapping = {}
+    for entry in specification.split("|"):
+        entities = [get_entity(entity.strip()) for entity in entry.split(":")]
+        key = entities[0]
+        values = [{"previous": entities[1], "output": entities[2]}]
+        if key in mapping:
+            mapping[key] += values
+        else:
+            mapping[key] = values
+    return OntologyIndex(mapping)
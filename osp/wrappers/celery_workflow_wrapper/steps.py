@@ -0,0 +1,64 @@
+"""Steps of a workflow forming a DAG, grouped into levels of concurrent steps."""
+from typing import TYPE_CHECKING
+
+from celery import group
+
+if TYPE_CHECKING:
+    from typing import Dict, Iterable, List, Tuple
+
+    from celery.canvas import Signature
+
+    from osp.core.cuds import Cuds
+
+
+class WorkflowSteps:
+    """Calculations of a workflow and the steps whose outputs they consume.
+
+    Steps without defined dependencies depend on the previous step."""
+
+    def __init__(self) -> None:
+        self.tasks: "List[Tuple[Cuds, str]]" = []
+        self.depends: "Dict[int, List[int]]" = {}
+
+    def add(self, mapping: "Tuple[Cuds, str]") -> None:
+        """Add the calculation and the name of the worker running it."""
+        self.tasks.append(mapping)
+
+    def add_dependencies(self, index: int, depends: "Iterable[int]") -> None:
+        """Define the steps whose outputs are consumed by the step with the index."""
+        self.depends[index] = sorted(set(depends))
+
+    def resolve(self) -> "List[List[int]]":
+        """Return the dependencies of all steps, including the implicit ones."""
+        return [
+            self.depends.get(index, [index - 1] if index else [])
+            for index in range(len(self.tasks))
+        ]
+
+
+def make_levels(depends: "List[List[int]]") -> "List[List[int]]":
+    """Group the steps of the DAG by the length of their longest dependency path.
+
+    All steps of a level only consume outputs of previous levels
+    and are hence executed concurrently."""
+    levels: "List[int]" = []
+    for index, step_depends in enumerate(depends):
+        if any(depend >= index for depend in step_depends):
+            raise ValueError(
+                f"Workflow step {index} depends on a later step: {step_depends}"
+            )
+        levels.append(max((levels[depend] + 1 for depend in step_depends), default=0))
+    return [
+        [index for index, level in enumerate(levels) if level == current]
+        for current in range(max(levels, default=-1) + 1)
+    ]
+
+
+def make_chord(tasks: "List[Signature]", callback: "Signature") -> "Signature":
+    """Chain the tasks of a level with the callback advancing the workflow.
+
+    Several tasks are joined by a chord, whose callback receives the list
+    of their results, a single task passes its result as is."""
+    if len(tasks) > 1:
+        return group(tasks) | callback
+    return tasks[0] | callback
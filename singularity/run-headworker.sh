@@ -7,5 +7,6 @@ singularity run \
         --env-file $1 \
         --env REAXPRO_WORKER_NAME=simphony-workflows \
         --env APP_MODE=worker \
+        --env REAXPRO_WORKER_BEAT=true \
         --pwd $TMPDIR \
         "fastapi-celery_${APP_VERSION}-singularity-production.sif"